@@ -1,11 +1,29 @@
-
+import atexit
+import fcntl
+import functools
+import hashlib
+import heapq
+import json
+import math
+import mmap
 import os
 import re
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import time
 import uuid
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_request_context, request, jsonify, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from PyPDF2 import PdfReader
@@ -15,7 +33,67 @@ UPLOAD_ROOT = Path("uploads")
 UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
 
 ALLOWED_EXTS = {".pdf", ".png", ".jpg", ".jpeg"}
+IMAGE_EXTS = {".png", ".jpg", ".jpeg"}
 MAX_CONTENT_LENGTH = 25 * 1024 * 1024  # 25 MB
+UPLOAD_CHUNK = 1024 * 1024  # las subidas se copian y hashean en trozos de 1 MB
+
+# Almacén global direccionado por contenido, junto a UPLOAD_ROOT: STORE_ROOT/<sha[:2]>/<sha>/
+# con el blob subido (las sesiones solo lo enlazan), el artefacto de extracción
+# (<PARSER_VERSION>.json) y el segmento de índice. Subir la versión invalida los artefactos.
+STORE_ROOT = UPLOAD_ROOT.parent / ".store"
+STORE_ROOT.mkdir(parents=True, exist_ok=True)
+PARSER_VERSION = "pypdf2-4"
+MANIFEST_FILENAME = ".manifest.json"  # por sesión: ficheros con hash, tamaño, páginas y estado
+MANIFEST_VERSION = 1
+INDEX_FILENAME = ".index.bin"  # índice binario de la sesión (se abre con mmap)
+
+# Extracción en paralelo por rangos de páginas (solo PDFs largos; 1 worker = siempre en serie)
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+PARALLEL_MIN_PAGES = int(os.environ.get("PARALLEL_MIN_PAGES", 40))
+PAGE_BATCH = 16  # páginas por tarea del pool: las primeras llegan antes y parar a medias ahorra el resto
+
+# Respuesta anticipada en /api/chat con PDFs recién subidos: se extrae página a página
+# hasta tener la respuesta o agotar el plazo, y el resto de la ingesta sigue en segundo plano
+EARLY_ANSWER_DEADLINE = float(os.environ.get("EARLY_ANSWER_DEADLINE", 10))  # s; 0 = ingesta completa antes de responder
+
+# OCR de imágenes subidas: motor local (ver OCR_ENGINES; "none" = no indexar imágenes),
+# en un pool de procesos acotado y cacheado por hash. Cambiar motor o idioma invalida la caché.
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "tesseract")
+OCR_LANG = os.environ.get("OCR_LANG", "spa")
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", 2))
+OCR_TIMEOUT = 120  # s por imagen
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", "tesseract")
+OCR_VERSION = f"ocr-{OCR_ENGINE}-{OCR_LANG}-1"
+
+# Corpus de sesión en memoria (por proceso); se descartan las sesiones menos usadas
+MAX_CACHED_SESSIONS = int(os.environ.get("MAX_CACHED_SESSIONS", 64))
+
+# Ingesta asíncrona (POST /api/sessions/<id>/files): hilos por worker y estado de los trabajos en disco
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 2))
+JOBS_ROOT = UPLOAD_ROOT.parent / ".jobs"
+JOBS_ROOT.mkdir(parents=True, exist_ok=True)
+INGEST_PENDING_TIMEOUT = 15 * 60  # s; una ingesta pendiente más antigua se da por perdida
+
+# Limpieza de sesiones: caducan tras SESSION_TTL sin uso y, si los blobs del almacén
+# superan UPLOAD_QUOTA_BYTES, se borran las menos usadas. Los contadores de uso viven
+# en USAGE_PATH (las cuotas nunca recorren el árbol). Bytes; 0 = sin límite.
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 7 * 24 * 3600))  # s
+SESSION_QUOTA_BYTES = int(os.environ.get("SESSION_QUOTA_BYTES", 200 * 1024 * 1024))
+UPLOAD_QUOTA_BYTES = int(os.environ.get("UPLOAD_QUOTA_BYTES", 5 * 1024 * 1024 * 1024))
+GC_INTERVAL = int(os.environ.get("GC_INTERVAL", 600))  # s entre barridos; 0 = sin barrendero
+GC_MIN_IDLE = 5 * 60  # s; por cuota no se borra una sesión usada hace menos de esto
+USAGE_PATH = UPLOAD_ROOT.parent / ".usage.json"
+
+# Métricas (/api/metrics, formato de texto de Prometheus): cada worker vuelca las
+# suyas a un fichero propio en METRICS_DIR y el endpoint suma las de todos
+METRICS_DIR = UPLOAD_ROOT.parent / ".metrics"
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 2))  # s entre volcados
+
+# Ranking BM25 (cada frase es un "documento" de la colección de la sesión)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Términos en el vocabulario del proceso a partir de los cuales se vacía cuando nadie lo usa
+VOCAB_MAX_TERMS = int(os.environ.get("VOCAB_MAX_TERMS", 500_000))
 
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
@@ -26,43 +104,236 @@ CORS(app)
 def allowed_file(name_or_path) -> bool:
     return Path(name_or_path).suffix.lower() in ALLOWED_EXTS
 
+def indexable(name_or_path) -> bool:
+    # Ficheros cuyo texto entra en el corpus: PDFs e imágenes si hay motor de OCR
+    suffix = Path(name_or_path).suffix.lower()
+    return suffix == ".pdf" or (suffix in IMAGE_EXTS and ocr_enabled())
+
+def parser_version(name_or_path) -> str:
+    # Versión del extractor que produce el artefacto de un fichero (clave de la caché)
+    return OCR_VERSION if is_image(name_or_path) else PARSER_VERSION
+
 def ensure_session_dir(session_id: str) -> Path:
+    """Directorio de la sesión (se crea si no existe). Lanza ValueError si el id no es válido."""
+    # El id se une a UPLOAD_ROOT: nada de "..", barras ni ids vacíos o enormes
+    if not isinstance(session_id, str) or not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", session_id):
+        raise ValueError("Identificador de sesión no válido (letras, dígitos, '-' o '_'; como mucho 64).")
     ses = UPLOAD_ROOT / session_id
     ses.mkdir(parents=True, exist_ok=True)
+    os.utime(ses)  # el mtime del directorio es el último uso (TTL y LRU del barrendero)
     return ses
 
 def save_file(file_storage, dest_dir: Path) -> Path:
+    """
+    Guarda una subida en una sola pasada: se copia al almacén calculando hash y
+    tamaño a la vez, y la sesión recibe un enlace al blob y su entrada en el manifiesto.
+    """
     safe_name = secure_filename(file_storage.filename or f"file_{uuid.uuid4().hex}")
     if not allowed_file(safe_name):
         raise ValueError("Tipo de archivo no permitido (usa .pdf/.png/.jpg/.jpeg).")
     dest = dest_dir / safe_name
     dest_dir.mkdir(parents=True, exist_ok=True)
-    file_storage.save(dest)
+    USAGE.read()  # crea los contadores antes de sumar nada
+    # El enlace provisional protege el blob del barrido que pueda lanzar enforce_quotas
+    pin = dest_dir / f".{safe_name}.{uuid.uuid4().hex}.tmp"
+    try:
+        digest, size = stream_to_store(file_storage.stream, pin)
+        replaced = _recorded_digest(dest) if dest.exists() else None
+        delta = size - (dest.stat().st_size if dest.exists() else 0)
+        try:
+            enforce_quotas(dest_dir.name, delta)
+        except QuotaExceeded:
+            pin.unlink(missing_ok=True)
+            _drop_blob_if_unused(digest)
+            raise
+        try:
+            _record_file(dest, digest, install=pin)  # sustitución atómica del fichero de la sesión
+        except BaseException:
+            USAGE.update(dest_dir.name, -delta)
+            raise
+    finally:
+        pin.unlink(missing_ok=True)  # rename entre enlaces del mismo inodo no hace nada
+    if replaced and replaced != digest:
+        _drop_blob_if_unused(replaced)  # la versión anterior ya no la enlaza esta sesión
+    METRICS.inc("umaer_upload_bytes_total", size)
     return dest
 
-def extract_text_from_pdf(pdf_path: Path) -> str:
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+_extract_pool: Optional[ProcessPoolExecutor] = None
+_extract_pool_lock = threading.Lock()
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    # Se crea perezosamente: cada worker de gunicorn tiene su propio pool tras el fork
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+        return _extract_pool
+
+def _extract_page(reader: PdfReader, i: int) -> Tuple[str, float]:
+    # (texto, segundos que tardó); una página ilegible cuenta como vacía
+    t0 = time.perf_counter()
+    try:
+        text = reader.pages[i].extract_text() or ""
+    except Exception:
+        text = ""
+    return text, time.perf_counter() - t0
+
+def _record_extracted(seconds: float, kind: str = "pdf") -> None:
+    # Solo páginas extraídas de verdad: las que salen de la caché no cuentan
+    METRICS.inc("umaer_extracted_pages_total", kind=kind)
+    METRICS.observe("umaer_extract_page_seconds", seconds, kind=kind)
+
+def _page_texts(reader: PdfReader, pages: Iterable[int]) -> Iterator[str]:
+    for i in pages:
+        text, seconds = _extract_page(reader, i)
+        _record_extracted(seconds)
+        yield text
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[Tuple[str, float]]:
+    # Se ejecuta en un proceso del pool: cada uno abre su propio lector y
+    # devuelve los tiempos para que las métricas las registre el proceso padre
+    reader = PdfReader(pdf_path)
+    return [_extract_page(reader, i) for i in range(start, stop)]
+
+ProgressFn = Callable[[int, int], None]  # (páginas hechas, páginas totales)
+
+def _extract_pages_parallel(pdf_path: Path, pages: List[int]) -> Iterator[str]:
+    # Tramos de páginas consecutivas (como mucho PAGE_BATCH) repartidos en el pool;
+    # los textos salen en orden de página según van terminando
+    global _extract_pool
+    step = max(1, min(PAGE_BATCH, -(-len(pages) // EXTRACT_WORKERS)))
+    ranges: List[List[int]] = []
+    for i in pages:
+        if ranges and ranges[-1][1] == i and i - ranges[-1][0] < step:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i, i + 1])
+    pool = _get_extract_pool()
+    futures = [pool.submit(_extract_page_range, str(pdf_path), a, b) for a, b in ranges]
     try:
-        reader = PdfReader(str(pdf_path))
-        buff = []
-        for page in reader.pages:
+        for (a, b), fut in zip(ranges, futures):
             try:
-                buff.append(page.extract_text() or "")
-            except Exception:
-                buff.append("")
-        return "\n".join(buff)
-    except Exception as e:
-        return f"[No se pudo extraer texto de {pdf_path.name}: {e}]"
+                texts = fut.result()
+            except BrokenProcessPool:
+                with _extract_pool_lock:
+                    if _extract_pool is pool:
+                        _extract_pool = None
+                texts = _extract_page_range(str(pdf_path), a, b)
+            for text, seconds in texts:
+                _record_extracted(seconds)
+                yield text
+    finally:
+        for fut in futures:  # si quien itera para antes, no extraer el resto
+            fut.cancel()
 
-def collect_session_texts(ses_dir: Path) -> List[Tuple[str, str]]:
+def iter_pdf_pages(pdf_path: Path, digest: Optional[str] = None,
+                   progress: Optional[ProgressFn] = None) -> Iterator[str]:
     """
-    Devuelve [(nombre_fichero, texto)] solo de PDFs.
-    (Si quisieras OCR para imágenes, aquí sería el sitio.)
+    Texto de cada página, en orden y bajo demanda: quien itera puede parar en
+    cuanto tenga bastante. Con `digest` cada página se guarda en la caché del
+    almacén y las ya extraídas (por otra petición, o por una ingesta que paró a
+    medias) no se vuelven a extraer. Lanza excepción si el PDF no se puede abrir.
     """
-    out = []
-    for p in ses_dir.iterdir():
-        if p.suffix.lower() == ".pdf":
-            out.append((p.name, extract_text_from_pdf(p)))
-    return out
+    reader = PdfReader(str(pdf_path))
+    n_pages = len(reader.pages)
+    cached = _cached_pages(digest) if digest else set()
+    missing = [i for i in range(n_pages) if i not in cached]
+    if EXTRACT_WORKERS > 1 and len(missing) >= PARALLEL_MIN_PAGES:
+        fresh = _extract_pages_parallel(pdf_path, missing)
+    else:
+        fresh = _page_texts(reader, missing)
+    try:
+        for i in range(n_pages):
+            if i in cached:
+                text = _page_path(digest, i).read_bytes().decode("utf-8")
+            else:
+                text = next(fresh)
+                if digest:
+                    _cache_page(digest, i, text)
+            if progress:
+                progress(i + 1, n_pages)
+            yield text
+    finally:
+        fresh.close()
+
+def _read_pdf_text(pdf_path: Path, progress: Optional[ProgressFn] = None) -> str:
+    # Lanza excepción si el PDF no se puede abrir (para no cachear fallos)
+    return "\n".join(iter_pdf_pages(pdf_path, progress=progress))
+
+def extract_text_from_pdf(pdf_path: Path) -> str:
+    try:
+        return _read_pdf_text(pdf_path)
+    except Exception as e:
+        return f"[No se pudo extraer texto de {pdf_path.name}: {e}]"
+
+
+# ---------- OCR de imágenes ----------
+def _ocr_tesseract(image_path: str) -> str:
+    # Un hilo por proceso de tesseract: el paralelismo lo pone el pool
+    proc = subprocess.run([TESSERACT_CMD, image_path, "stdout", "-l", OCR_LANG],
+                          capture_output=True, timeout=OCR_TIMEOUT,
+                          env={**os.environ, "OMP_THREAD_LIMIT": "1"})
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode("utf-8", "replace").strip() or f"tesseract salió con {proc.returncode}")
+    return proc.stdout.decode("utf-8", "replace")
+
+# Motores disponibles: nombre -> función (ruta de la imagen) -> texto, que se
+# ejecuta en un proceso del pool (debe poder importarse desde este módulo)
+OCR_ENGINES: Dict[str, Callable[[str], str]] = {
+    "tesseract": _ocr_tesseract,
+}
+
+def _run_ocr(engine: str, image_path: str) -> Tuple[str, float]:
+    t0 = time.perf_counter()
+    text = OCR_ENGINES[engine](image_path)
+    return text, time.perf_counter() - t0
+
+_ocr_pool: Optional[ProcessPoolExecutor] = None
+_ocr_pool_lock = threading.Lock()
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+        return _ocr_pool
+
+# Comprobación de que el motor se puede usar en esta máquina (sin ella se da por disponible)
+OCR_AVAILABLE: Dict[str, Callable[[], bool]] = {
+    "tesseract": lambda: shutil.which(TESSERACT_CMD) is not None,
+}
+
+@functools.lru_cache(maxsize=None)
+def _ocr_available(engine: str) -> bool:
+    check = OCR_AVAILABLE.get(engine)
+    return check is None or check()
+
+def ocr_enabled() -> bool:
+    return OCR_ENGINE in OCR_ENGINES and _ocr_available(OCR_ENGINE)
+
+def is_image(name_or_path) -> bool:
+    return Path(name_or_path).suffix.lower() in IMAGE_EXTS
+
+def ocr_image(image_path: Path) -> str:
+    """Texto reconocido en una imagen (en el pool de OCR). Lanza excepción si el motor falla."""
+    global _ocr_pool
+    pool = _get_ocr_pool()
+    try:
+        text, seconds = pool.submit(_run_ocr, OCR_ENGINE, str(image_path)).result()
+    except BrokenProcessPool:
+        with _ocr_pool_lock:
+            if _ocr_pool is pool:
+                _ocr_pool = None
+        raise
+    _record_extracted(seconds, kind="ocr")
+    return text
 
 
 # ---------- “NLP” ligero ----------
@@ -82,36 +353,1533 @@ def tokenize(text: str) -> List[str]:
 def key_terms(text: str) -> List[str]:
     return [t for t in tokenize(text) if t not in STOPWORDS and len(t) > 2]
 
+def sentence_spans(text: str) -> List[Tuple[int, str]]:
+    # Segmentación simple por puntos/interrogaciones/exclamaciones y saltos de línea:
+    # [(offset del primer carácter en `text`, frase)]
+    spans = []
+    for m in re.finditer(r"[^\.!\?\n]+", text):
+        sent = m.group().strip()
+        if sent:
+            spans.append((m.start() + len(m.group()) - len(m.group().lstrip()), sent))
+    return spans
+
 def split_sentences(text: str) -> List[str]:
-    # Segmentación simple por puntos/interrogaciones/exclamaciones y saltos de línea
-    parts = re.split(r"[\.!\?\n]+", text)
-    return [p.strip() for p in parts if p.strip()]
+    return [sent for _, sent in sentence_spans(text)]
+
+def sentence_terms(sentences: List[str]) -> List[List[str]]:
+    # Almacén de frases pre-tokenizadas: se calcula una vez en la ingesta
+    return [key_terms(s) for s in sentences]
 
-def score_sentence(sentence: str, q_terms: List[str]) -> int:
-    s_terms = set(key_terms(sentence))
+def score_sentence(sentence: str, q_terms: List[str], s_terms=None) -> int:
+    # s_terms: conjunto de términos ya normalizados de la frase (evita el regex)
+    if s_terms is None:
+        s_terms = set(key_terms(sentence))
     return sum(1 for t in q_terms if t in s_terms)
 
-def extractive_answer(docs: List[Tuple[str, str]], question: str, top_k: int = 3):
-    q_terms = key_terms(question)
+class Vocabulary:
+    """
+    Diccionario término -> id entero, compartido por todos los documentos del
+    proceso. Los índices en memoria guardan ids en arrays en vez de cadenas; los
+    de disco guardan el texto, así que los ids solo viven mientras dura una
+    operación (bloques use()). Cuando sale el último bloque y hay más de
+    max_terms términos, el vocabulario se vacía.
+    """
+
+    def __init__(self, max_terms: int = 0):
+        self.ids: Dict[str, int] = {}
+        self.terms: List[str] = []
+        self.max_terms = max_terms
+        self._users = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def use(self):
+        with self._lock:
+            self._users += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._users -= 1
+                if not self._users and self.max_terms and len(self.terms) > self.max_terms:
+                    self.ids, self.terms = {}, []
+
+    def intern(self, term: str) -> int:
+        tid = self.ids.get(term)
+        if tid is None:
+            with self._lock:
+                tid = self.ids.get(term)
+                if tid is None:
+                    tid = self.ids[term] = len(self.terms)
+                    self.terms.append(term)
+        return tid
+
+
+VOCAB = Vocabulary(VOCAB_MAX_TERMS)
+
+def uses_vocab(fn):
+    # Los ids de término que maneje `fn` siguen siendo válidos hasta que termine
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with VOCAB.use():
+            return fn(*args, **kwargs)
+    return wrapper
+
+def build_postings(terms_by_sent: List[List[str]]) -> Tuple[Dict[int, Tuple[array, array]], array]:
+    """
+    Índice invertido de un documento a partir de sus frases pre-tokenizadas:
+    id de término -> (ids de frase, tfs), dos array('I') paralelos ordenados por
+    frase, más la longitud (nº de términos clave) de cada frase.
+    """
+    lists: Dict[int, Tuple[List[int], List[int]]] = {}
+    lengths = array("I")
+    intern = VOCAB.intern
+    for sid, terms in enumerate(terms_by_sent):
+        lengths.append(len(terms))
+        tfs: Dict[int, int] = {}
+        for t in terms:
+            tid = intern(t)
+            tfs[tid] = tfs.get(tid, 0) + 1
+        for tid, tf in tfs.items():
+            entry = lists.get(tid)
+            if entry is None:
+                entry = lists[tid] = ([], [])
+            entry[0].append(sid)
+            entry[1].append(tf)
+    postings = {tid: (array("I", sids), array("I", tfs)) for tid, (sids, tfs) in lists.items()}
+    return postings, lengths
+
+def index_document(doc: dict) -> dict:
+    # Los términos en texto solo hacen falta para construir el índice
+    terms = doc.pop("terms", None)
+    if terms is None:
+        terms = sentence_terms(doc["sentences"])
+    doc["postings"], doc["lengths"] = build_postings(terms)
+    return doc
+
+
+class BM25Stats:
+    """
+    Estadísticas de colección para BM25 (nº de frases, longitud total y df por
+    término). Se actualizan documento a documento al cargar o quitar ficheros.
+    """
+
+    def __init__(self):
+        self.n_sents = 0
+        self.total_len = 0
+        self.df: Dict[int, int] = {}  # id de término -> nº de frases que lo contienen
+
+    @classmethod
+    def from_docs(cls, docs: List[dict]) -> "BM25Stats":
+        stats = cls()
+        for doc in docs:
+            stats.add(doc)
+        return stats
+
+    def add(self, doc: dict) -> None:
+        self.n_sents += len(doc["lengths"])
+        self.total_len += sum(doc["lengths"])
+        for tid, (sids, _) in doc["postings"].items():
+            self.df[tid] = self.df.get(tid, 0) + len(sids)
+
+    def remove(self, doc: dict) -> None:
+        self.n_sents -= len(doc["lengths"])
+        self.total_len -= sum(doc["lengths"])
+        for tid, (sids, _) in doc["postings"].items():
+            left = self.df[tid] - len(sids)
+            if left:
+                self.df[tid] = left
+            else:
+                del self.df[tid]
+
+    def copy(self) -> "BM25Stats":
+        new = BM25Stats()
+        new.n_sents, new.total_len = self.n_sents, self.total_len
+        new.df = dict(self.df.items())
+        return new
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.n_sents if self.n_sents else 1.0
+
+    def idf(self, tid: Optional[int]) -> float:
+        # None: término que no está en el vocabulario, y por tanto en ninguna frase
+        df = self.df.get(tid, 0) if tid is not None else 0
+        return math.log(1 + (self.n_sents - df + 0.5) / (df + 0.5))
+
+
+def bm25_scores(doc: dict, q_ids: List[int], stats: BM25Stats) -> Dict[int, float]:
+    """Score BM25 de las frases del documento que contienen algún término de la pregunta."""
+    lengths = doc["lengths"]
+    postings = doc["postings"]
+    avgdl = stats.avgdl
+    acc: Dict[int, float] = {}
+    for tid in q_ids:
+        if tid not in postings:
+            continue
+        idf = stats.idf(tid)
+        sids, tfs = postings[tid]
+        for sid, tf in zip(sids, tfs):
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths[sid] / avgdl)
+            acc[sid] = acc.get(sid, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+    return acc
+
+def doc_upper_bound(doc: dict, q_ids: List[int], stats: BM25Stats) -> float:
+    # Cota superior del score de cualquier frase del documento: cada término
+    # aporta menos de idf * (k1 + 1), sea cual sea su tf o la longitud.
+    postings = doc["postings"]
+    return sum(stats.idf(tid) * (BM25_K1 + 1) for tid in q_ids if tid in postings)
+
+def _ranked_docs(docs: List[dict], q_ids: List[int], stats: BM25Stats):
+    # Documentos con algún término de la pregunta, de mayor a menor cota
+    bounds = [(doc_upper_bound(doc, q_ids, stats), pos, doc) for pos, doc in enumerate(docs)]
+    bounds.sort(key=lambda x: (-x[0], x[1]))
+    for ub, pos, doc in bounds:
+        if ub <= 0:
+            return
+        yield ub, pos, doc
+
+def _page_of(doc: dict, sid: int) -> Optional[int]:
+    # Página (desde 1) de una frase, si el documento la conoce
+    pages = doc.get("pages")
+    return pages[sid] + 1 if pages is not None else None
+
+def _scored_sentences(doc: dict, pos: int, q_ids: List[int], stats: BM25Stats):
+    # (score, longitud, -pos, -sid, frase, fichero, página): comparar tuplas reproduce
+    # el orden por (score, longitud) desc con desempate por posición original
+    sentences = doc["sentences"]
+    for sid, score in bm25_scores(doc, q_ids, stats).items():
+        sent = sentences[sid]
+        yield score, len(sent), -pos, -sid, sent, doc["name"], _page_of(doc, sid)
+
+Hit = Tuple[float, str, str, Optional[int]]  # (score, frase, fichero, página desde 1 o None)
+
+def query_ids(q_terms: List[str], docs: List[dict]) -> List[int]:
+    """
+    Ids de los términos de la pregunta que aparecen en algún documento. Un término
+    que el proceso no conoce solo se interna si está en un índice en disco: las
+    preguntas no hacen crecer el vocabulario.
+    """
+    ids = []
+    for t in q_terms:
+        tid = VOCAB.ids.get(t)
+        if tid is None and any(isinstance(d["postings"], _PostingsView) and d["postings"].has_term(t)
+                               for d in docs):
+            tid = VOCAB.intern(t)
+        if tid is not None:
+            ids.append(tid)
+    return ids
+
+@uses_vocab
+def rank_sentences(docs: List[dict], question: str, top_k: int = 3,
+                   stats: Optional[BM25Stats] = None) -> List[Hit]:
+    """
+    Las top_k frases [(score, frase, fichero, página)] de mejor a peor.
+    docs: documentos de collect_session_docs (frases ya segmentadas en la ingesta).
+    stats: estadísticas BM25 de la sesión (SessionCorpus.stats); si faltan se calculan.
+    Solo se visitan las frases que comparten algún término con la pregunta, y
+    solo se guardan las top_k mejores en un heap (memoria O(k)).
+    """
+    q_terms = list(dict.fromkeys(key_terms(question)))
+    if not q_terms:
+        return []
+
+    for doc in docs:
+        if "postings" not in doc:
+            index_document(doc)
+    if stats is None:
+        stats = BM25Stats.from_docs(docs)
+    q_ids = query_ids(q_terms, docs)
+
+    heap: list = []  # min-heap con las top_k candidatas
+    for ub, pos, doc in _ranked_docs(docs, q_ids, stats):
+        if len(heap) == top_k and ub <= heap[0][0]:
+            break  # ninguna frase de los documentos restantes puede superar la k-ésima
+        for cand in _scored_sentences(doc, pos, q_ids, stats):
+            if len(heap) < top_k:
+                heapq.heappush(heap, cand)
+            elif cand > heap[0]:
+                heapq.heapreplace(heap, cand)
+
+    return [(c[0], c[4], c[5], c[6]) for c in sorted(heap, reverse=True)]
+
+def format_hits(top: List[Hit]) -> str:
+    return "\n".join([f"• {s}  ({fn}, pág. {page})" if page else f"• {s}  ({fn})" for _, s, fn, page in top])
+
+def extractive_answer(docs: List[dict], question: str, top_k: int = 3, stats: Optional[BM25Stats] = None):
+    top = rank_sentences(docs, question, top_k, stats)
+    if not top:
+        return None
+    return format_hits(top)
+
+def _bm25_terms(terms: List[str], q_terms: List[str], stats: BM25Stats) -> float:
+    # BM25 de una frase aún sin indexar (sus términos en texto) con las estadísticas de la sesión
+    avgdl = stats.avgdl
+    score = 0.0
+    for t in q_terms:
+        tf = terms.count(t)
+        if tf:
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * len(terms) / avgdl)
+            score += stats.idf(VOCAB.ids.get(t)) * tf * (BM25_K1 + 1) / norm
+    return score
+
+@uses_vocab
+def early_answer(question: str, docs: List[dict], pending: List[Path], top_k: int = 3,
+                 deadline: Optional[float] = None, stats: Optional[BM25Stats] = None) -> List[Hit]:
+    """
+    Las top_k frases [(score, frase, fichero, página)] sin esperar a la ingesta de los
+    PDFs `pending`, que se recorren página a página (iter_pdf_pages). En ellos las
+    candidatas se eligen por el nº de términos de la pregunta presentes en la frase
+    (score_sentence), cuyo máximo se conoce: en cuanto hay top_k frases con todos los
+    términos ninguna página restante puede superarlas y se deja de extraer. También
+    se para al pasar `deadline` (time.monotonic()). Los documentos ya indexados `docs`
+    se rankean con BM25 (rank_sentences) y las candidatas de `pending` se puntúan con
+    BM25 sobre las mismas estadísticas (`stats`, las de la sesión) para mezclar ambas.
+    """
+    q_terms = list(dict.fromkeys(key_terms(question)))
     if not q_terms:
+        return []
+    full = len(q_terms)
+    heap: list = []  # (score, longitud, -pos, frase, fichero, página), como en rank_sentences
+    pos = 0
+
+    def offer(score: int, sent: str, name: str, page: Optional[int]) -> bool:
+        # True cuando ya no hace falta mirar más frases
+        cand = (score, len(sent), -pos, sent, name, page)
+        if len(heap) < top_k:
+            heapq.heappush(heap, cand)
+        elif cand > heap[0]:
+            heapq.heapreplace(heap, cand)
+        return len(heap) == top_k and heap[0][0] == full
+
+    def done() -> bool:
+        return (len(heap) == top_k and heap[0][0] == full) or (
+            deadline is not None and time.monotonic() >= deadline)
+
+    for path in pending:
+        pages = iter_pdf_pages(path, _recorded_digest(path))
+        try:
+            for page, text in enumerate(pages, 1):
+                for sent in split_sentences(text):
+                    pos += 1
+                    score = score_sentence(sent, q_terms)
+                    if score and offer(score, sent, path.name, page):
+                        break
+                if done():
+                    break
+        except Exception:
+            pass  # PDF ilegible: el trabajo de ingesta dejará constancia del error
+        finally:
+            pages.close()
+        if done():
+            break
+
+    fresh = [(c[0], c[3], c[4], c[5]) for c in sorted(heap, reverse=True)]
+    if not docs:
+        return fresh
+    indexed = rank_sentences(docs, question, top_k, stats)
+    if stats is None:
+        stats = BM25Stats.from_docs(docs)
+    fresh = [(_bm25_terms(key_terms(sent), q_terms, stats), sent, name, page) for _, sent, name, page in fresh]
+    # Mismo orden que rank_sentences (score y longitud); a igualdad, antes lo ya indexado
+    return sorted(indexed + fresh, key=lambda h: (h[0], len(h[1])), reverse=True)[:top_k]
+
+
+# ---------- Índice de sesión en disco (compartido vía mmap) ----------
+# Formato (orden de bytes nativo, guardado en los metadatos):
+#   FILE_HDR: magic, versión, offset y longitud de los metadatos JSON
+#   un segmento por documento (offsets internos relativos al segmento, alineados a 8):
+#     SEG_HDR, registros TERM_REC ordenados por el término en utf-8, cadenas de
+#     términos, sids y tfs (u32), longitudes de frase (u32), offsets de frase
+#     (u64, n+1), texto de las frases (utf-8) y, por frase, página y offset
+#     dentro del texto de la página (u32)
+#   tabla global de df (TERM_REC con count = df) para BM25
+#   metadatos JSON: docs (nombre, sha256, tamaño, mtime, offset, longitud), df, totales
+INDEX_MAGIC = b"UMXI"
+INDEX_VERSION = 2
+FILE_HDR = struct.Struct("<4sIQQ")
+SEG_HDR = struct.Struct("<III4x10Q")  # n_sents, n_terms, n_post + 9 offsets + longitud del segmento
+TERM_REC = struct.Struct("<QIIQ")  # offset cadena, longitud cadena, count, offset postings
+
+def _pad8(buf: bytearray) -> None:
+    buf.extend(b"\0" * (-len(buf) % 8))
+
+def _term_table(entries: List[Tuple[bytes, int, int]]) -> Tuple[bytes, bytes]:
+    # entries ordenadas (término utf-8, count, offset postings) -> (registros, cadenas)
+    recs = bytearray()
+    strs = bytearray()
+    for term, count, post_off in entries:
+        recs += TERM_REC.pack(len(strs), len(term), count, post_off)
+        strs += term
+    return bytes(recs), bytes(strs)
+
+def _encode_segment(doc: dict):
+    # Los documentos que ya vienen de un índice en disco se copian tal cual
+    if "_segment" in doc:
+        return doc["_segment"]
+
+    terms = VOCAB.terms
+    items = sorted((terms[tid].encode("utf-8"), sids, tfs) for tid, (sids, tfs) in doc["postings"].items())
+    all_sids, all_tfs, entries = array("I"), array("I"), []
+    for term, sids, tfs in items:
+        entries.append((term, len(sids), len(all_sids)))
+        all_sids.extend(sids)
+        all_tfs.extend(tfs)
+    recs, strs = _term_table(entries)
+
+    text = bytearray()
+    offsets = array("Q", [0])
+    for sent in doc["sentences"]:
+        text += sent.encode("utf-8")
+        offsets.append(len(text))
+
+    seg = bytearray(SEG_HDR.size)
+    offs = []
+    n = len(doc["sentences"])
+    pages = array("I", doc.get("pages") or [0] * n)
+    page_offsets = array("I", doc.get("offsets") or [0] * n)
+    for part in (recs, strs, all_sids.tobytes(), all_tfs.tobytes(),
+                 array("I", doc["lengths"]).tobytes(), offsets.tobytes(), text,
+                 pages.tobytes(), page_offsets.tobytes()):
+        _pad8(seg)
+        offs.append(len(seg))
+        seg += part
+    _pad8(seg)
+    SEG_HDR.pack_into(seg, 0, len(doc["sentences"]), len(entries), len(all_sids), *offs, len(seg))
+    return seg
+
+def write_session_index(path: Path, docs: List[dict], stats: BM25Stats) -> None:
+    """Escribe (de forma atómica) el índice binario de la sesión."""
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    meta_docs = []
+    with open(tmp, "wb") as fh:
+        fh.write(FILE_HDR.pack(INDEX_MAGIC, INDEX_VERSION, 0, 0))
+        for doc in docs:
+            seg = _encode_segment(doc)
+            meta_docs.append({"name": doc["name"], "sha256": doc.get("sha256"), "size": doc["size"],
+                              "mtime_ns": doc["mtime_ns"], "off": fh.tell(), "len": len(seg)})
+            fh.write(seg)
+
+        terms = VOCAB.terms
+        recs, strs = _term_table(sorted((terms[tid].encode("utf-8"), df, 0) for tid, df in stats.df.items()))
+        df_meta = {"n": len(recs) // TERM_REC.size, "off_recs": fh.tell(), "off_strs": fh.tell() + len(recs)}
+        fh.write(recs)
+        fh.write(strs)
+
+        meta = json.dumps({"byteorder": sys.byteorder, "n_sents": stats.n_sents, "total_len": stats.total_len,
+                           "docs": meta_docs, "df": df_meta}, ensure_ascii=False).encode("utf-8")
+        meta_off = fh.tell()
+        fh.write(meta)
+        fh.seek(0)
+        fh.write(FILE_HDR.pack(INDEX_MAGIC, INDEX_VERSION, meta_off, len(meta)))
+    os.replace(tmp, path)
+
+
+class _TermTable:
+    """Registros TERM_REC ordenados dentro del mmap; búsqueda binaria por término."""
+
+    def __init__(self, buf: memoryview, off_recs: int, n: int, off_strs: int):
+        self.buf, self.off_recs, self.n, self.off_strs = buf, off_recs, n, off_strs
+
+    def _term(self, i: int) -> Tuple[bytes, int, int]:
+        so, sl, count, post_off = TERM_REC.unpack_from(self.buf, self.off_recs + i * TERM_REC.size)
+        start = self.off_strs + so
+        return bytes(self.buf[start:start + sl]), count, post_off
+
+    def find(self, term: str) -> Optional[Tuple[int, int]]:
+        """(count, offset de postings) del término, o None si no está."""
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n:
+            t, count, post_off = self._term(lo)
+            if t == key:
+                return count, post_off
+        return None
+
+    def __iter__(self):
+        for i in range(self.n):
+            t, count, post_off = self._term(i)
+            yield t.decode("utf-8"), count, post_off
+
+
+class _PostingsView:
+    """Postings de un segmento con la misma interfaz que el dict en memoria (id -> (sids, tfs))."""
+
+    def __init__(self, table: _TermTable, sids: memoryview, tfs: memoryview):
+        self.table, self.sids, self.tfs = table, sids, tfs
+
+    def get(self, tid: int, default=None):
+        rec = self.table.find(VOCAB.terms[tid])
+        if rec is None:
+            return default
+        count, off = rec
+        return self.sids[off:off + count], self.tfs[off:off + count]
+
+    def __contains__(self, tid: int) -> bool:
+        return self.table.find(VOCAB.terms[tid]) is not None
+
+    def has_term(self, term: str) -> bool:
+        return self.table.find(term) is not None
+
+    def __getitem__(self, tid: int):
+        found = self.get(tid)
+        if found is None:
+            raise KeyError(tid)
+        return found
+
+    def items(self):
+        for term, count, off in self.table:
+            yield VOCAB.intern(term), (self.sids[off:off + count], self.tfs[off:off + count])
+
+
+class _DfView:
+    """df global de la sesión (id de término -> nº de frases), leído del mmap."""
+
+    def __init__(self, table: _TermTable):
+        self.table = table
+
+    def get(self, tid: int, default: int = 0) -> int:
+        rec = self.table.find(VOCAB.terms[tid])
+        return rec[0] if rec is not None else default
+
+    def items(self):
+        for term, count, _ in self.table:
+            yield VOCAB.intern(term), count
+
+
+class _SentencesView:
+    """Frases de un segmento, decodificadas bajo demanda."""
+
+    def __init__(self, offsets: memoryview, text: memoryview):
+        self.offsets, self.text = offsets, text
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.text[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+
+def _segment_doc(seg: memoryview, meta: dict) -> dict:
+    (n_sents, n_terms, n_post, off_recs, off_strs, off_sids, off_tfs,
+     off_lens, off_offsets, off_text, off_pages, off_page_offsets, _) = SEG_HDR.unpack_from(seg, 0)
+    offsets = seg[off_offsets:off_offsets + 8 * (n_sents + 1)].cast("Q")
+    return {
+        "name": meta["name"],
+        "sha256": meta["sha256"],
+        "size": meta["size"],
+        "mtime_ns": meta["mtime_ns"],
+        "sentences": _SentencesView(offsets, seg[off_text:off_text + offsets[n_sents]]),
+        "postings": _PostingsView(_TermTable(seg, off_recs, n_terms, off_strs),
+                                  seg[off_sids:off_sids + 4 * n_post].cast("I"),
+                                  seg[off_tfs:off_tfs + 4 * n_post].cast("I")),
+        "lengths": seg[off_lens:off_lens + 4 * n_sents].cast("I"),
+        "pages": seg[off_pages:off_pages + 4 * n_sents].cast("I"),
+        "offsets": seg[off_page_offsets:off_page_offsets + 4 * n_sents].cast("I"),
+        "_segment": seg,
+    }
+
+
+class SessionIndex:
+    """
+    Índice de sesión abierto con mmap (solo lectura). Los documentos tienen la
+    misma forma que los de index_document, así que extractive_answer no
+    distingue entre uno y otro; los datos los comparte la page cache.
+    """
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as fh:
+            st = os.fstat(fh.fileno())
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        buf = memoryview(self._mm)
+        magic, version, meta_off, meta_len = FILE_HDR.unpack_from(buf, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"Índice con formato desconocido: {path}")
+        meta = json.loads(bytes(buf[meta_off:meta_off + meta_len]))
+        if meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"Índice escrito con otro orden de bytes: {path}")
+
+        self.docs = [_segment_doc(buf[d["off"]:d["off"] + d["len"]], d) for d in meta["docs"]]
+        self.files = {d["name"]: (d["size"], d["mtime_ns"]) for d in meta["docs"]}
+        df = meta["df"]
+        self.stats = BM25Stats()
+        self.stats.n_sents, self.stats.total_len = meta["n_sents"], meta["total_len"]
+        self.stats.df = _DfView(_TermTable(buf, df["off_recs"], df["n"], df["off_strs"]))
+
+
+# ---------- Ingesta (en la subida, no en cada consulta) ----------
+def _store_dir(digest: str) -> Path:
+    return STORE_ROOT / digest[:2] / digest
+
+def _blob_path(digest: str) -> Path:
+    return _store_dir(digest) / "blob"
+
+def _artifact_path(digest: str, version: str = PARSER_VERSION) -> Path:
+    return _store_dir(digest) / f"{version}.json"
+
+def _segment_path(digest: str, version: str = PARSER_VERSION) -> Path:
+    return _store_dir(digest) / f"{version}-idx{INDEX_VERSION}.seg"
+
+def _page_path(digest: str, page: int) -> Path:
+    return _store_dir(digest) / f"{PARSER_VERSION}.pages" / f"{page:05d}.txt"
+
+def _cached_pages(digest: str) -> set:
+    # Números de página con texto ya en la caché
+    try:
+        with os.scandir(_page_path(digest, 0).parent) as it:
+            return {int(e.name[:-4]) for e in it if e.name.endswith(".txt")}
+    except FileNotFoundError:
+        return set()
+
+def _cache_page(digest: str, page: int, text: str) -> None:
+    path = _page_path(digest, page)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_bytes(text.encode("utf-8"))  # en bytes: sin traducir saltos de línea
+    os.replace(tmp, path)
+
+def stream_to_store(stream, pin: Path, chunk_size: int = UPLOAD_CHUNK) -> Tuple[str, int]:
+    """
+    Copia `stream` a un temporal del almacén calculando sha256 y tamaño en la
+    misma pasada, y lo publica como blob si el contenido no existía. Deja además
+    un enlace al blob en `pin` (un temporal de la sesión): mientras exista, ningún
+    barrido puede dar el blob por huérfano. Devuelve (hash, bytes).
+    """
+    tmp = STORE_ROOT / f".upload.{uuid.uuid4().hex}.tmp"
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, "wb") as fh:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                h.update(chunk)
+                fh.write(chunk)
+                size += len(chunk)
+        digest = h.hexdigest()
+        blob = _blob_path(digest)
+        os.chmod(tmp, 0o444)  # los blobs son inmutables (comparten inodo con las sesiones)
+        while True:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(tmp, blob)  # sin pisar un blob que ya exista (subida duplicada)
+                USAGE.update(store_delta=size)
+                METRICS.inc("umaer_cache_requests_total", cache="blob", result="miss")
+            except FileExistsError:
+                METRICS.inc("umaer_cache_requests_total", cache="blob", result="hit")
+            try:
+                os.link(blob, pin)
+                break
+            except FileNotFoundError:
+                continue  # un barrido borró el blob entre medias: publicarlo de nuevo
+            except OSError:
+                shutil.copyfile(blob, pin)  # sin enlaces duros: copia
+                break
+    finally:
+        tmp.unlink(missing_ok=True)
+    return digest, size
+
+def store_file(path: Path) -> str:
+    """
+    Guarda el contenido de `path` en el almacén (una sola copia por sha256) y
+    deja en la sesión un enlace duro al blob. Devuelve el hash.
+    """
+    digest = file_sha256(path)
+    blob = _blob_path(digest)
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        try:
+            os.link(path, blob)  # primera vez que vemos este contenido
+            os.chmod(blob, 0o444)  # los blobs son inmutables (comparten inodo con las sesiones)
+            USAGE.update(store_delta=blob.stat().st_size)
+        except FileExistsError:
+            if not os.path.samefile(path, blob):
+                tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+                os.link(blob, tmp)
+                os.replace(tmp, path)
+    except OSError:
+        pass  # sin enlaces duros (p. ej. otro sistema de ficheros): la sesión conserva su copia
+    return digest
+
+@contextmanager
+def _flocked(lock_path: Path):
+    # Exclusión entre workers (y entre hilos: cada uso abre su propio descriptor)
+    with open(lock_path, "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _write_json_atomic(path: Path, data) -> None:
+    # Escritura atómica: varios workers pueden escribir el mismo fichero a la vez
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _read_json(path: Path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _page_texts_of(path: Path, digest: str, progress: Optional[ProgressFn] = None) -> List[str]:
+    # Texto por página: el PDF página a página, una imagen es una sola página (OCR)
+    if is_image(path):
+        text = ocr_image(path)
+        if progress:
+            progress(1, 1)
+        return [text]
+    return list(iter_pdf_pages(path, digest, progress))
+
+def build_artifact(pdf_path: Path, digest: str, progress: Optional[ProgressFn] = None) -> Tuple[dict, bool]:
+    """
+    Extrae y segmenta un PDF página a página (o el texto de una imagen por OCR).
+    Devuelve (artefacto, ok); si ok es False el artefacto no tiene texto ni
+    frases, lleva el motivo en "error" y no debe persistirse.
+    """
+    try:
+        page_texts = _page_texts_of(pdf_path, digest, progress)
+        ok = True
+    except Exception as e:
+        error = f"No se pudo extraer texto de {pdf_path.name}: {e}"
+        return {"sha256": digest, "text": "", "n_pages": 0, "sentences": [], "pages": [], "offsets": [],
+                "terms": [], "error": error}, False
+    # Procedencia de cada frase: página (desde 0) y offset dentro del texto de esa página
+    sentences, pages, offsets = [], [], []
+    for page, text in enumerate(page_texts):
+        for off, sent in sentence_spans(text):
+            sentences.append(sent)
+            pages.append(page)
+            offsets.append(off)
+    return {"sha256": digest, "text": "\n".join(page_texts), "n_pages": len(page_texts),
+            "sentences": sentences, "pages": pages, "offsets": offsets,
+            "terms": sentence_terms(sentences)}, ok
+
+def cached_artifact(pdf_path: Path, digest: Optional[str] = None, progress: Optional[ProgressFn] = None) -> dict:
+    """
+    Artefacto de un PDF (texto + frases con su página y offset + términos de cada frase) desde la caché por hash; si no
+    existe se construye y se persiste. Los fallos no se cachean.
+    """
+    digest = digest or file_sha256(pdf_path)
+    ap = _artifact_path(digest, parser_version(pdf_path))
+    art = _read_json(ap)
+    METRICS.inc("umaer_cache_requests_total", cache="artifact", result="hit" if art is not None else "miss")
+    if art is not None:
+        return art
+    art, ok = build_artifact(pdf_path, digest, progress)
+    if ok:
+        _write_json_atomic(ap, art)
+    return art
+
+class SessionManifest:
+    """
+    Manifiesto de una sesión (MANIFEST_FILENAME): por fichero, hash, tamaño,
+    mtime, nº de páginas, estado de la ingesta ("stored", "ready", "error"; con
+    pending_since mientras un trabajo la tiene en curso) y versiones de
+    extractor e índice. Listar la sesión, responder el estado y saber si un
+    documento está listo son lecturas de este fichero, sin recorrer el
+    directorio; sync() lo contrasta con un stat por entrada para enterarse de
+    ficheros borrados o sustituidos por fuera. Se reescribe entero (atómico y
+    bajo flock) en cada cambio.
+    """
+
+    def __init__(self, ses_dir: Path):
+        self.ses_dir = ses_dir
+        self.path = ses_dir / MANIFEST_FILENAME
+
+    def _scan(self) -> dict:
+        # Sesiones anteriores al manifiesto: se recorre el directorio una sola vez
+        files = {}
+        with os.scandir(self.ses_dir) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                st = entry.stat()
+                files[entry.name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "status": "stored"}
+        return files
+
+    def _load(self) -> Dict[str, dict]:
+        data = _read_json(self.path)
+        if data is None or data.get("version") != MANIFEST_VERSION:
+            files = self._scan()
+            self._save(files)
+            return files
+        return data["files"]
+
+    def _save(self, files: Dict[str, dict]) -> None:
+        _write_json_atomic(self.path, {"version": MANIFEST_VERSION, "files": files})
+
+    def files(self) -> Dict[str, dict]:
+        """nombre -> entrada, de una sola lectura."""
+        data = _read_json(self.path)
+        if data is not None and data.get("version") == MANIFEST_VERSION:
+            return data["files"]
+        with _flocked(self.ses_dir / ".manifest.lock"):
+            return self._load()
+
+    def put(self, name: str, entry: dict, install: Optional[Path] = None) -> None:
+        # Con el mismo contenido se conserva lo ya sabido de la ingesta. install: temporal
+        # que se renombra a `name` dentro del cerrojo, para que sync no vea el cambio a medias
+        with _flocked(self.ses_dir / ".manifest.lock"):
+            if install is not None:
+                os.replace(install, self.ses_dir / name)
+            st = os.stat(self.ses_dir / name)
+            entry = {**entry, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            files = self._load()
+            old = files.get(name)
+            new = {"status": "stored"}
+            if old and old.get("sha256") == entry.get("sha256") and old.get("status") != "error":
+                new.update((k, old[k]) for k in ("status", "pages", "parser", "index_version") if k in old)
+            new.update(entry)
+            files[name] = new
+            self._save(files)
+
+    def remove(self, name: str) -> Optional[dict]:
+        """Quita la entrada de `name`; devuelve la que había (o None)."""
+        with _flocked(self.ses_dir / ".manifest.lock"):
+            files = self._load()
+            entry = files.pop(name, None)
+            if entry is not None:
+                self._save(files)
+            return entry
+
+    def sync(self) -> Tuple[Dict[str, dict], List[Tuple[int, Optional[str]]]]:
+        """
+        Contrasta las entradas con el directorio: se quitan las de ficheros que
+        ya no existen y las de ficheros con otro tamaño o mtime vuelven a
+        "stored" sin hash (la siguiente ingesta los vuelve a pasar al almacén).
+        Devuelve (ficheros, [(bytes de diferencia, hash que ya no se usa)]).
+        """
+        def changed(files: Dict[str, dict]) -> Dict[str, Optional[os.stat_result]]:
+            out = {}
+            for name, entry in files.items():
+                try:
+                    st = os.stat(self.ses_dir / name)
+                except FileNotFoundError:
+                    out[name] = None
+                    continue
+                if (entry.get("size"), entry.get("mtime_ns")) != (st.st_size, st.st_mtime_ns):
+                    out[name] = st
+            return out
+
+        files = self.files()
+        if not changed(files):
+            return files, []
+        released = []
+        with _flocked(self.ses_dir / ".manifest.lock"):
+            files = self._load()
+            for name, st in changed(files).items():
+                old = files.pop(name)
+                if st is None:
+                    released.append((-old.get("size", 0), old.get("sha256")))
+                else:
+                    files[name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "status": "stored"}
+                    released.append((st.st_size - old.get("size", 0), old.get("sha256")))
+            self._save(files)
+        return files, released
+
+    def patch(self, name: str, digest: Optional[str] = None, **fields) -> None:
+        # Solo si la entrada existe (y sigue siendo `digest`); None borra el campo
+        with _flocked(self.ses_dir / ".manifest.lock"):
+            files = self._load()
+            entry = files.get(name)
+            if entry is None or (digest is not None and entry.get("sha256") != digest):
+                return
+            for k, v in fields.items():
+                if v is None:
+                    entry.pop(k, None)
+                else:
+                    entry[k] = v
+            self._save(files)
+
+
+def session_files(ses_dir: Path) -> Dict[str, dict]:
+    """
+    Ficheros de la sesión (nombre -> entrada del manifiesto) tras SessionManifest.sync:
+    lo borrado por fuera deja de contar en los contadores de uso y su blob se
+    libera si nadie más lo enlaza.
+    """
+    files, released = SessionManifest(ses_dir).sync()
+    for delta, digest in released:
+        if delta:
+            USAGE.update(ses_dir.name, delta)
+        if digest:
+            _drop_blob_if_unused(digest)
+    return files
+
+def _recorded_entry(path: Path) -> Optional[dict]:
+    # Entrada del manifiesto, solo si el fichero no ha cambiado desde que se registró
+    entry = SessionManifest(path.parent).files().get(path.name)
+    if not entry or "sha256" not in entry:
+        return None
+    st = path.stat()
+    if (entry.get("size"), entry.get("mtime_ns")) != (st.st_size, st.st_mtime_ns):
         return None
+    return entry
+
+def _record_file(path: Path, digest: str, pending: bool = False, install: Optional[Path] = None) -> None:
+    entry = {"sha256": digest}
+    if pending:
+        entry["pending_since"] = time.time()  # ingesta encargada a un trabajo en segundo plano
+    SessionManifest(path.parent).put(path.name, entry, install)
+
+def _failed_entry(name: str, entry: dict) -> bool:
+    # Extracción fallida con el extractor e índice actuales: no se reintenta hasta una nueva subida
+    return (entry.get("status") == "error" and entry.get("parser") == parser_version(name)
+            and entry.get("index_version") == INDEX_VERSION)
+
+def ingest_failed(path: Path) -> bool:
+    """True si la última ingesta del fichero falló (su texto no entra en el corpus)."""
+    entry = _recorded_entry(path)
+    return entry is not None and _failed_entry(path.name, entry)
 
-    candidates = []  # (score, sentence, filename)
-    for fname, fulltext in docs:
-        for sent in split_sentences(fulltext):
-            sc = score_sentence(sent, q_terms)
-            if sc > 0:
-                candidates.append((sc, sent, fname))
+def ingest_pending(path: Path) -> bool:
+    """True si el fichero tiene un trabajo de ingesta en curso (las consultas no lo esperan)."""
+    entry = _recorded_entry(path)
+    return (entry is not None and "pending_since" in entry
+            and time.time() - entry["pending_since"] < INGEST_PENDING_TIMEOUT)
 
-    if not candidates:
+def session_ingesting(ses_dir: Path) -> bool:
+    """True si algún fichero de la sesión tiene un trabajo de ingesta en curso."""
+    now = time.time()
+    return any(now - e["pending_since"] < INGEST_PENDING_TIMEOUT
+               for e in SessionManifest(ses_dir).files().values() if "pending_since" in e)
+
+def _recorded_digest(path: Path) -> Optional[str]:
+    entry = _recorded_entry(path)
+    return entry["sha256"] if entry else None
+
+@uses_vocab
+def _cached_segment(digest: str, doc: dict, version: str = PARSER_VERSION) -> bytes:
+    # Segmento de índice del documento; se construye una vez por contenido
+    sp = _segment_path(digest, version)
+    try:
+        seg = sp.read_bytes()
+        METRICS.inc("umaer_cache_requests_total", cache="segment", result="hit")
+        return seg
+    except FileNotFoundError:
+        METRICS.inc("umaer_cache_requests_total", cache="segment", result="miss")
+    seg = bytes(_encode_segment(index_document(doc)))
+    if _artifact_path(digest, version).exists():  # no persistir índices de extracciones fallidas
+        tmp = sp.with_name(f"{sp.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(seg)
+        os.replace(tmp, sp)
+    return seg
+
+def ingest_file(path: Path, progress: Optional[ProgressFn] = None) -> Optional[dict]:
+    """
+    Etapa de ingesta: se llama una vez por fichero subido. Si es un PDF (o una
+    imagen, con OCR) nuevo, lo extrae, segmenta, tokeniza e indexa una sola vez
+    y lo anota en el manifiesto. Los ficheros que no llegaron por save_file
+    (sin entrada válida en el manifiesto) se pasan antes al almacén.
+    """
+    digest = _recorded_digest(path)
+    if digest is None:
+        digest = store_file(path)
+        _record_file(path, digest)
+    if not indexable(path):
         return None
+    version = parser_version(path)
+    art = cached_artifact(path, digest, progress)
+    _cached_segment(digest, dict(art), version)
+    SessionManifest(path.parent).patch(
+        path.name, digest, status="ready" if _artifact_path(digest, version).exists() else "error",
+        pages=art.get("n_pages"), parser=version, index_version=INDEX_VERSION)
+    return art
+
+def document_ready(path: Path) -> bool:
+    """True si el manifiesto da el documento por indexado con el extractor e índice actuales."""
+    entry = _recorded_entry(path)
+    return (entry is not None and entry.get("status") == "ready"
+            and entry.get("parser") == parser_version(path) and entry.get("index_version") == INDEX_VERSION)
+
+def document_digest(path: Path) -> str:
+    """Hash de un fichero de la sesión, desde el manifiesto (se ingiere si es antiguo o ha cambiado)."""
+    digest = _recorded_digest(path)
+    if digest is None:
+        ingest_file(path)
+        digest = _recorded_digest(path)
+    return digest
+
+def load_document(path: Path) -> dict:
+    """Documento ya ingerido (o se ingiere ahora si es un fichero antiguo o ha cambiado)."""
+    digest = document_digest(path)
+    art = _read_json(_artifact_path(digest, parser_version(path)))
+    if art is None:
+        art = cached_artifact(path, digest)
+    return dict(art, name=path.name)
+
+def load_indexed_document(path: Path, size: int, mtime_ns: int) -> dict:
+    """Documento listo para el índice de sesión, a partir del segmento del almacén."""
+    digest = document_digest(path)
+    version = parser_version(path)
+    try:
+        seg = _segment_path(digest, version).read_bytes()
+    except FileNotFoundError:
+        seg = _cached_segment(digest, load_document(path), version)
+    meta = {"name": path.name, "sha256": digest, "size": size, "mtime_ns": mtime_ns}
+    return _segment_doc(memoryview(seg), meta)
+
+class SessionCorpus:
+    """
+    Corpus de una sesión. Los documentos indexados viven en el fichero de índice
+    de la sesión (INDEX_FILENAME), abierto con mmap y compartido por todos los
+    workers. En cada refresh solo se lee el manifiesto de la sesión: si los PDFs
+    (y las imágenes, si hay OCR) coinciden con los
+    del índice se usa tal cual; si no, se reescribe reutilizando los segmentos
+    de los ficheros sin cambios y tomando del almacén los nuevos o modificados.
+    Los ficheros cuya extracción falló se quedan fuera sin reintentarla.
+    """
+
+    def __init__(self, ses_dir: Path):
+        self.ses_dir = ses_dir
+        self.index_path = ses_dir / INDEX_FILENAME
+        self.index: Optional[SessionIndex] = None
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> BM25Stats:
+        return self.index.stats if self.index else BM25Stats()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        # nombre -> (tamaño, mtime_ns), desde el manifiesto
+        return {name: (e["size"], e["mtime_ns"]) for name, e in session_files(self.ses_dir).items()
+                if indexable(name) and not _failed_entry(name, e)}
+
+    def _reopen(self) -> None:
+        # Otro worker puede haber reescrito el índice desde que lo abrimos
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            self.index = None
+            return
+        if self.index is None or self.index.key != (st.st_ino, st.st_mtime_ns, st.st_size):
+            try:
+                self.index = SessionIndex(self.index_path)
+            except (ValueError, KeyError, struct.error):
+                self.index = None  # versión antigua o fichero corrupto: se reconstruye
+
+    def _rebuild(self, files: Dict[str, Tuple[int, int]]) -> None:
+        old = {d["name"]: d for d in self.index.docs} if self.index else {}
+        stats = self.index.stats.copy() if self.index else BM25Stats()
+        docs = []
+        for name in sorted(files):
+            doc = old.pop(name, None)
+            if doc is not None and (doc["size"], doc["mtime_ns"]) == files[name]:
+                docs.append(doc)
+                continue
+            if doc is not None:
+                stats.remove(doc)
+            doc = load_indexed_document(self.ses_dir / name, *files[name])
+            stats.add(doc)
+            docs.append(doc)
+        for doc in old.values():  # ficheros borrados
+            stats.remove(doc)
+        write_session_index(self.index_path, docs, stats)
+        self.index = SessionIndex(self.index_path)
+
+    @uses_vocab
+    def refresh(self, only_ready: bool = False) -> List[dict]:
+        """
+        Documentos indexados de la sesión. Con only_ready=True no se extrae ni
+        indexa nada en línea: los ficheros sin segmento en el almacén se omiten.
+        """
+        with self._lock:
+            files = self._scan()
+            if self.index is None or self.index.files != files:
+                self._reopen()
+            indexed = self.index.files if self.index else {}
+            if indexed != files:
+                # No esperar a los ficheros que se están ingiriendo en segundo plano:
+                # se mantiene la versión ya indexada (si la hay) hasta que terminen
+                for name in [n for n in files if indexed.get(n) != files[n]]:
+                    path = self.ses_dir / name
+                    if ingest_pending(path) or (only_ready and not document_ready(path)):
+                        if name in indexed:
+                            files[name] = indexed[name]
+                        else:
+                            del files[name]
+                if indexed != files:
+                    self._rebuild(files)
+            return self.index.docs if self.index else []
+
+
+_corpora: "OrderedDict[str, SessionCorpus]" = OrderedDict()
+_corpora_lock = threading.Lock()
+
+def get_session_corpus(ses_dir: Path) -> SessionCorpus:
+    key = str(ses_dir)
+    with _corpora_lock:
+        corpus = _corpora.get(key)
+        METRICS.inc("umaer_cache_requests_total", cache="session", result="hit" if corpus is not None else "miss")
+        if corpus is None:
+            corpus = _corpora[key] = SessionCorpus(ses_dir)
+        _corpora.move_to_end(key)
+        while len(_corpora) > MAX_CACHED_SESSIONS:
+            _corpora.popitem(last=False)
+        return corpus
+
+def collect_session_docs(ses_dir: Path) -> List[dict]:
+    """
+    Devuelve los documentos de la sesión ya indexados (PDFs e imágenes con OCR):
+    {"name", "sha256", "size", "mtime_ns", "sentences", "postings", "lengths", "pages", "offsets"}.
+    """
+    return get_session_corpus(ses_dir).refresh()
+
+def collect_session_texts(ses_dir: Path) -> List[Tuple[str, str]]:
+    """Devuelve [(nombre_fichero, texto)] de PDFs e imágenes con OCR (desde los artefactos de ingesta)."""
+    names = sorted(n for n, e in session_files(ses_dir).items() if indexable(n) and not _failed_entry(n, e))
+    return [(n, load_document(ses_dir / n)["text"]) for n in names]
+
+
+# ---------- Trabajos de ingesta en segundo plano ----------
+_ingest_pool: Optional[ThreadPoolExecutor] = None
+_ingest_pool_lock = threading.Lock()
+
+def _get_ingest_pool() -> ThreadPoolExecutor:
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is None:
+            _ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+        return _ingest_pool
+
+def _job_path(job_id: str) -> Path:
+    return JOBS_ROOT / f"{job_id}.json"
+
+def read_job(job_id: str) -> Optional[dict]:
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return None
+    return _read_json(_job_path(job_id))
+
+
+class IngestJob:
+    """
+    Estado de un trabajo de ingesta. Se guarda en JOBS_ROOT para que cualquier
+    worker pueda responder a GET /api/jobs/<id>; el progreso por páginas se
+    escribe como mucho cada SAVE_INTERVAL segundos.
+    """
+
+    SAVE_INTERVAL = 0.5
+
+    def __init__(self, session_id: str, names: List[str]):
+        self.id = uuid.uuid4().hex
+        now = time.time()
+        self.data = {
+            "job_id": self.id,
+            "session_id": session_id,
+            "status": "queued",
+            "created": now,
+            "updated": now,
+            "files": [{"name": n, "status": "queued", "pages_done": 0, "pages_total": None, "error": None}
+                      for n in names],
+        }
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, i: Optional[int] = None, force: bool = True, **fields) -> None:
+        with self._lock:
+            (self.data if i is None else self.data["files"][i]).update(fields)
+            self.data["updated"] = time.time()
+            if force or time.monotonic() - self._saved_at >= self.SAVE_INTERVAL:
+                self._saved_at = time.monotonic()
+                _write_json_atomic(_job_path(self.id), self.data)
+
+
+def _run_ingest_job(job: IngestJob, ses_dir: Path, paths: List[Path]) -> None:
+    job.update(status="running")
+    failed = False
+    for i, path in enumerate(paths):
+        if not ses_dir.is_dir():
+            # La sesión se borró (caducada o por cuota) con el trabajo en marcha
+            failed = True
+            job.update(i, status="error", error="La sesión ya no existe.")
+            continue
+        job.update(i, status="processing")
+        try:
+            art = ingest_file(path, progress=lambda done, total, i=i: job.update(
+                i, force=done == total, pages_done=done, pages_total=total))
+            if art is not None and not _artifact_path(art["sha256"], parser_version(path)).exists():
+                failed = True
+                job.update(i, status="error", error=art.get("error"))
+            elif art is not None:
+                # Con el artefacto ya en caché no hay progreso por páginas: se da por completo
+                job.update(i, status="done", pages_done=art["n_pages"], pages_total=art["n_pages"])
+            else:
+                job.update(i, status="done")
+        except Exception as e:
+            failed = True
+            job.update(i, status="error", error=str(e))
+        finally:
+            # Quitar la marca de pendiente: a partir de aquí las consultas ya lo usan
+            try:
+                SessionManifest(ses_dir).patch(path.name, pending_since=None)
+            except FileNotFoundError:
+                pass  # la sesión se borró mientras tanto
+    try:
+        if ses_dir.is_dir():
+            get_session_corpus(ses_dir).refresh()  # deja el índice de la sesión listo para el siguiente turno
+    except Exception as e:
+        failed = True
+        job.update(error=str(e))
+    job.update(status="error" if failed else "done")
+
+def submit_ingest_job(session_id: str, ses_dir: Path, paths: List[Path]) -> IngestJob:
+    for path in paths:
+        _record_file(path, _recorded_digest(path) or store_file(path), pending=True)
+    job = IngestJob(session_id, [p.name for p in paths])
+    job.update()
+    _get_ingest_pool().submit(_run_ingest_job, job, ses_dir, paths)
+    return job
+
+
+# ---------- Cuotas y limpieza de sesiones ----------
+class QuotaExceeded(Exception):
+    """Subida rechazada por falta de cuota; status es el código HTTP a devolver."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class UsageLedger:
+    """
+    Contadores de uso en disco compartidos por todos los workers: bytes de los
+    ficheros de cada sesión y bytes únicos de los blobs del almacén. Viven en un
+    JSON que se modifica bajo flock, así que comprobar una cuota es leer un
+    fichero; el árbol solo se recorre si ese fichero no existe todavía.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock_path = path.with_name(f"{path.name}.lock")
+
+    def _count(self) -> dict:
+        # Recuento completo, solo para crear los contadores la primera vez
+        sessions = {}
+        for ses in UPLOAD_ROOT.iterdir():
+            if ses.is_dir():
+                sessions[ses.name] = sum(p.stat().st_size for p in ses.iterdir()
+                                         if p.is_file() and not p.name.startswith("."))
+        store = sum(p.stat().st_size for p in STORE_ROOT.glob("*/*/blob"))
+        return {"sessions": sessions, "store_bytes": store}
+
+    def _load(self) -> dict:
+        data = _read_json(self.path)
+        if data is None:
+            data = self._count()
+            _write_json_atomic(self.path, data)
+        return data
+
+    def read(self) -> dict:
+        data = _read_json(self.path)
+        if data is None:
+            with _flocked(self.lock_path):
+                data = self._load()
+        return data
+
+    def update(self, session: Optional[str] = None, delta: int = 0, store_delta: int = 0,
+               limit: int = 0) -> dict:
+        """
+        Suma delta a la sesión y store_delta al almacén. Con limit, si la sesión
+        pasaría de limit bytes no se suma nada y se lanza QuotaExceeded (413).
+        """
+        with _flocked(self.lock_path):
+            data = self._load()
+            if session is not None:
+                used = data["sessions"].get(session, 0) + delta
+                if limit and delta > 0 and used > limit:
+                    raise QuotaExceeded(f"La sesión supera su cuota de {limit // (1024 * 1024)} MB.", 413)
+                data["sessions"][session] = max(0, used)
+            data["store_bytes"] = max(0, data["store_bytes"] + store_delta)
+            _write_json_atomic(self.path, data)
+            return data
+
+    def drop_session(self, session: str) -> None:
+        with _flocked(self.lock_path):
+            data = self._load()
+            if data["sessions"].pop(session, None) is not None:
+                _write_json_atomic(self.path, data)
+
+
+USAGE = UsageLedger(USAGE_PATH)
+
+def enforce_quotas(session_id: str, delta: int) -> None:
+    """
+    Carga `delta` bytes a la sesión si caben en SESSION_QUOTA_BYTES. Si el
+    almacén pasa de UPLOAD_QUOTA_BYTES se barre antes de rechazar (507).
+    """
+    USAGE.update(session_id, delta, limit=SESSION_QUOTA_BYTES)
+    if UPLOAD_QUOTA_BYTES and USAGE.read()["store_bytes"] > UPLOAD_QUOTA_BYTES:
+        sweep_sessions(exclude={session_id})
+        if USAGE.read()["store_bytes"] > UPLOAD_QUOTA_BYTES:
+            USAGE.update(session_id, -delta)
+            raise QuotaExceeded("No queda espacio para más subidas; inténtalo más tarde.", 507)
+
+def _drop_blob_if_unused(digest: str) -> None:
+    # Si solo queda el enlace del almacén, nadie usa ese contenido: fuera blob y derivados
+    blob = _blob_path(digest)
+    try:
+        st = blob.stat()
+    except FileNotFoundError:
+        return
+    if st.st_nlink > 1:
+        return
+    shutil.rmtree(_store_dir(digest), ignore_errors=True)
+    USAGE.update(store_delta=-st.st_size)
+
+def delete_session(ses_dir: Path) -> None:
+    """Borra una sesión, sus contadores y los blobs que solo usaba ella."""
+    digests = {e["sha256"] for e in SessionManifest(ses_dir).files().values() if "sha256" in e}
+    with _corpora_lock:
+        _corpora.pop(str(ses_dir), None)
+    shutil.rmtree(ses_dir, ignore_errors=True)
+    USAGE.drop_session(ses_dir.name)
+    for digest in digests:
+        _drop_blob_if_unused(digest)
+
+def sweep_sessions(exclude=frozenset()) -> List[str]:
+    """
+    Borra las sesiones sin uso desde hace SESSION_TTL y, mientras los blobs del
+    almacén superen UPLOAD_QUOTA_BYTES, las menos usadas (LRU por el mtime del
+    directorio). Las sesiones con una ingesta en curso no se tocan (extraer no
+    cambia el mtime). También los trabajos de ingesta antiguos. Devuelve los ids borrados.
+    """
+    removed = []
+    with _flocked(USAGE_PATH.with_name(".gc.lock")):  # un solo barrido a la vez entre workers
+        now = time.time()
+        sessions = []  # (último uso, directorio), de más antigua a más reciente
+        with os.scandir(UPLOAD_ROOT) as it:
+            for entry in it:
+                if entry.is_dir() and entry.name not in exclude and not session_ingesting(Path(entry.path)):
+                    sessions.append((entry.stat().st_mtime, Path(entry.path)))
+        sessions.sort()
+        for last_used, ses in sessions:
+            if SESSION_TTL and now - last_used > SESSION_TTL:
+                delete_session(ses)
+                removed.append(ses.name)
+        for last_used, ses in sessions:
+            if not UPLOAD_QUOTA_BYTES or USAGE.read()["store_bytes"] <= UPLOAD_QUOTA_BYTES:
+                break
+            if ses.name not in removed and now - last_used >= GC_MIN_IDLE:
+                delete_session(ses)
+                removed.append(ses.name)
+        with os.scandir(JOBS_ROOT) as it:
+            for entry in it:
+                if SESSION_TTL and entry.name.endswith(".json") and now - entry.stat().st_mtime > SESSION_TTL:
+                    os.unlink(entry.path)
+    return removed
+
+_sweeper_pid: Optional[int] = None
+_sweeper_lock = threading.Lock()
+
+def _sweeper_loop() -> None:
+    while True:
+        try:
+            sweep_sessions()
+        except Exception:
+            app.logger.exception("Fallo al limpiar sesiones")
+        time.sleep(GC_INTERVAL)
+
+def start_sweeper() -> None:
+    # Un hilo por proceso (tras el fork de gunicorn); el flock de .gc.lock evita barridos simultáneos
+    global _sweeper_pid
+    if GC_INTERVAL <= 0 or _sweeper_pid == os.getpid():
+        return
+    with _sweeper_lock:
+        if _sweeper_pid != os.getpid():
+            _sweeper_pid = os.getpid()
+            threading.Thread(target=_sweeper_loop, name="session-gc", daemon=True).start()
+
+# ---------- Métricas (Prometheus) ----------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # s
+PAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10)  # s
+
+# nombre -> (tipo, ayuda, buckets de los histogramas)
+METRIC_DEFS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "umaer_http_requests_total": ("counter", "Peticiones HTTP por endpoint y código de estado.", ()),
+    "umaer_chat_request_seconds": ("histogram", "Latencia de /api/chat y /api/chat/stream por modo de respuesta.",
+                                   LATENCY_BUCKETS),
+    "umaer_extract_page_seconds": ("histogram", "Tiempo de extracción de cada página (sin contar las de la caché).",
+                                   PAGE_BUCKETS),
+    "umaer_extracted_pages_total": ("counter", "Páginas extraídas (PDF o imagen con OCR); no cuenta las leídas de la caché.", ()),
+    "umaer_upload_bytes_total": ("counter", "Bytes subidos a las sesiones.", ()),
+    "umaer_cache_requests_total": ("counter", "Consultas a las cachés por resultado (hit/miss).", ()),
+}
+
+def _label_str(labels: Dict[str, str]) -> str:
+    def esc(v) -> str:
+        return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join(f'{k}="{esc(v)}"' for k, v in sorted(labels.items()))
+
+def _num(v: float) -> str:
+    # Enteros sin notación científica (los contadores de bytes crecen mucho)
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class Metrics:
+    """
+    Contadores e histogramas del proceso, por serie ("nombre{etiquetas}"). Un
+    hilo los vuelca como mucho cada METRICS_FLUSH_INTERVAL s a un fichero propio
+    del worker en METRICS_DIR; collect() suma los de todos. Los ficheros de
+    workers que ya no existen se acumulan en uno solo (bajo flock), así que los
+    contadores no retroceden cuando gunicorn recicla un worker.
+    """
+
+    ARCHIVE = "_dead.json"
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Al arrancar y tras un fork: el hijo empieza de cero con su propio fichero
+        self._pid = os.getpid()
+        self.path = self.root / f"{self._pid}-{uuid.uuid4().hex[:8]}.json"
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, list] = {}  # serie -> [cuentas por bucket (+Inf al final), suma]
+        self._dirty = False
+        self._flusher_started = False
+
+    def _touch(self):
+        # Con self._lock tomado
+        if self._pid != os.getpid():
+            self._reset()
+        self._dirty = True
+        if not self._flusher_started:
+            self._flusher_started = True
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+            atexit.register(self.flush)  # lo pendiente al salir el worker
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = f"{name}{{{_label_str(labels)}}}"
+        with self._lock:
+            self._touch()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        buckets = METRIC_DEFS[name][2]
+        key = f"{name}{{{_label_str(labels)}}}"
+        with self._lock:
+            self._touch()
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            i = next((i for i, le in enumerate(buckets) if value <= le), len(buckets))
+            hist[i] += 1
+            hist[-1] += value
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty or self._pid != os.getpid():
+                return
+            snapshot = {"counters": dict(self.counters),
+                        "histograms": {k: list(v) for k, v in self.histograms.items()}}
+            self._dirty = False
+        _write_json_atomic(self.path, snapshot)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("Fallo al volcar métricas")
+
+    @staticmethod
+    def _merge(into: dict, snap: dict) -> None:
+        for k, v in snap.get("counters", {}).items():
+            into["counters"][k] = into["counters"].get(k, 0) + v
+        for k, v in snap.get("histograms", {}).items():
+            cur = into["histograms"].get(k)
+            if cur is None:
+                into["histograms"][k] = list(v)
+            elif len(cur) == len(v):  # si cambiaron los buckets, se queda la versión ya sumada
+                into["histograms"][k] = [a + b for a, b in zip(cur, v)]
+
+    @staticmethod
+    def _pid_alive(name: str) -> bool:
+        try:
+            os.kill(int(name.split("-", 1)[0]), 0)
+        except ProcessLookupError:
+            return False
+        except (ValueError, PermissionError):
+            pass
+        return True
+
+    def collect(self) -> dict:
+        """Suma de las métricas de todos los workers: {"counters": {...}, "histograms": {...}}."""
+        self.flush()
+        self.root.mkdir(parents=True, exist_ok=True)
+        total = {"counters": {}, "histograms": {}}
+        with _flocked(self.root / ".lock"):
+            archive = _read_json(self.root / self.ARCHIVE) or {"counters": {}, "histograms": {}}
+            dead = []
+            for p in self.root.glob("*-*.json"):
+                snap = _read_json(p)
+                if snap is None:
+                    continue
+                if self._pid_alive(p.name):
+                    self._merge(total, snap)
+                else:
+                    self._merge(archive, snap)
+                    dead.append(p)
+            if dead:
+                _write_json_atomic(self.root / self.ARCHIVE, archive)
+                for p in dead:
+                    p.unlink(missing_ok=True)
+        self._merge(total, archive)
+        return total
 
-    # ordenar por score (desc) y longitud (desc ligera para evitar frases muy cortas)
-    candidates.sort(key=lambda x: (x[0], len(x[1])), reverse=True)
-    top = candidates[:top_k]
+    def render(self) -> str:
+        """Formato de texto de Prometheus (0.0.4), con los gauges que se calculan al leer."""
+        data = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRIC_DEFS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                for key in sorted(k for k in data["counters"] if k.startswith(name + "{")):
+                    lines.append(f"{key.replace('{}', '')} {_num(data['counters'][key])}")
+                continue
+            for key in sorted(k for k in data["histograms"] if k.startswith(name + "{")):
+                labels = key[len(name) + 1:-1]
+                hist = data["histograms"][key]
+                sep = "," if labels else ""
+                cum = 0
+                for le, n in zip([f"{b:g}" for b in buckets] + ["+Inf"], hist[:-1]):
+                    cum += n
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cum}')
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {_num(hist[-1])}")
+                lines.append(f"{name}_count{suffix} {cum}")
 
-    hits = "\n".join([f"• {s}  ({fn})" for _, s, fn in top])
-    return hits
+        # Proporción de aciertos por caché, a partir de los contadores ya sumados
+        hits: Dict[str, List[float]] = {}
+        for key, v in data["counters"].items():
+            m = re.fullmatch(r'umaer_cache_requests_total\{cache="([^"]*)",result="(hit|miss)"\}', key)
+            if m:
+                hits.setdefault(m.group(1), [0, 0])[m.group(2) == "miss"] += v
+        lines += ["# HELP umaer_cache_hit_ratio Aciertos / consultas de cada caché desde el arranque.",
+                  "# TYPE umaer_cache_hit_ratio gauge"]
+        for cache, (hit, miss) in sorted(hits.items()):
+            lines.append(f'umaer_cache_hit_ratio{{cache="{cache}"}} {_num(hit / (hit + miss))}')
+
+        usage = USAGE.read()
+        lines += ["# HELP umaer_sessions Sesiones con ficheros en disco.", "# TYPE umaer_sessions gauge",
+                  f"umaer_sessions {len(usage.get('sessions', {}))}",
+                  "# HELP umaer_store_bytes Bytes únicos de los blobs del almacén.", "# TYPE umaer_store_bytes gauge",
+                  f"umaer_store_bytes {usage.get('store_bytes', 0)}"]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics(METRICS_DIR)
 
 
 # ---------- Respuestas de “chat ligero” ----------
@@ -145,23 +1913,123 @@ def smalltalk_reply(user_text: str) -> str:
     )
 
 
+# ---------- Tiempos por etapa (Server-Timing) ----------
+@contextmanager
+def timed(stage: str):
+    """
+    Suma la duración del bloque (ms) a la etapa `stage` de la petición en curso
+    (g.timings); fuera de una petición no mide nada.
+    """
+    if not has_request_context():
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = g.setdefault("timings", {})
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - t0) * 1000
+
+def request_timings() -> Dict[str, float]:
+    """Etapas medidas hasta ahora en esta petición más el total, en ms redondeados."""
+    timings = {k: round(v, 2) for k, v in g.get("timings", {}).items()}
+    if "t_start" in g:
+        timings["total"] = round((time.perf_counter() - g.t_start) * 1000, 2)
+    return timings
+
+def timings_requested() -> bool:
+    # ?timings=1, o campo "timings" en el JSON o en el formulario
+    flag = request.args.get("timings") or request.form.get("timings")
+    if flag is None and not _is_multipart():
+        js = request.get_json(silent=True)
+        flag = js.get("timings") if isinstance(js, dict) else None
+    return str(flag).lower() in ("1", "true", "yes", "on")
+
+
 # ---------- Rutas ----------
+@app.before_request
+def _ensure_sweeper():
+    start_sweeper()
+
+@app.before_request
+def _start_timer():
+    g.t_start = time.perf_counter()
+
+@app.after_request
+def _record_metrics(response):
+    METRICS.inc("umaer_http_requests_total", endpoint=request.endpoint or "(none)", status=response.status_code)
+    if "chat_mode" in g:
+        METRICS.observe("umaer_chat_request_seconds", time.perf_counter() - g.t_start, mode=g.chat_mode)
+    return response
+
+@app.after_request
+def _server_timing(response):
+    # Solo las rutas que miden etapas (no las respuestas en streaming, que aún no han empezado)
+    if "timings" in g:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{stage};dur={dur}" for stage, dur in request_timings().items())
+    return response
+
+
 @app.get("/api/health")
 def health():
     return jsonify(status="ok")
 
 
-@app.post("/api/chat")
-def chat():
+@app.get("/api/metrics")
+def metrics():
+    """Métricas de todos los workers en formato de texto de Prometheus."""
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/api/sessions/<session_id>/files")
+def upload_files(session_id):
     """
-    Acepta:
-    - multipart/form-data: fields 'message', 'session_id', y opcional 'files'
-    - application/json:    {"message": "...", "session_id": "..."}
+    Sube ficheros (multipart, campo 'files') a una sesión sin esperar a la
+    extracción: responde 202 con un job_id y la ingesta sigue en segundo plano.
     """
-    # 1) Leer message + session_id desde multipart o JSON
+    files = [f for f in request.files.getlist("files") if f and f.filename]
+    if not files:
+        return jsonify(error="No se ha enviado ningún fichero (campo 'files')."), 400
+    # Validar todo antes de guardar nada
+    for f in files:
+        if not allowed_file(secure_filename(f.filename)):
+            return jsonify(error="Tipo de archivo no permitido (usa .pdf/.png/.jpg/.jpeg)."), 415
+
+    try:
+        ses_dir = ensure_session_dir(session_id)
+    except ValueError as ve:
+        return jsonify(error=str(ve)), 400
+    try:
+        paths = [save_file(f, ses_dir) for f in files]
+    except QuotaExceeded as qe:
+        return jsonify(error=str(qe)), qe.status
+    job = submit_ingest_job(session_id, ses_dir, paths)
+    return jsonify(
+        job_id=job.id,
+        session_id=session_id,
+        files=[p.name for p in paths],
+        status_url=f"/api/jobs/{job.id}",
+    ), 202
+
+
+@app.get("/api/jobs/<job_id>")
+def job_status(job_id):
+    """Progreso de un trabajo de ingesta: estado y páginas hechas por fichero."""
+    job = read_job(job_id)
+    if job is None:
+        return jsonify(error="Trabajo no encontrado."), 404
+    return jsonify(job)
+
+
+def _is_multipart() -> bool:
+    return bool(request.content_type and "multipart/form-data" in request.content_type.lower())
+
+def read_chat_request() -> Tuple[str, str]:
+    """(message, session_id) desde multipart o JSON; sin session_id se crea uno nuevo."""
     message = ""
     session_id = request.form.get("session_id") or ""
-    if request.content_type and "multipart/form-data" in request.content_type.lower():
+    if _is_multipart():
         message = (request.form.get("message") or "").strip()
     else:
         try:
@@ -173,32 +2041,23 @@ def chat():
 
     if not session_id:
         session_id = uuid.uuid4().hex
+    return message, session_id
 
-    ses_dir = ensure_session_dir(session_id)
-
-    # 2) Guardar archivos si vienen en multipart
-    saved_files = []
-    if request.content_type and "multipart/form-data" in request.content_type.lower():
-        if "files" in request.files:
-            for f in request.files.getlist("files"):
-                if f and f.filename:
-                    try:
-                        dest = save_file(f, ses_dir)
-                        saved_files.append(dest.name)
-                    except ValueError as ve:
-                        return jsonify(error=str(ve)), 415
-
-    # 3) Cargar corpus de la sesión
-    docs = collect_session_texts(ses_dir)
+def uploaded_files() -> list:
+    if not _is_multipart():
+        return []
+    return [f for f in request.files.getlist("files") if f and f.filename]
 
-    # 4) Lógica de respuesta
+def chat_payload(session_id: str, message: str, docs: List[dict], saved_files: List[str],
+                 top: Optional[List[Hit]] = None, stats: Optional[BM25Stats] = None) -> dict:
+    """Respuesta de /api/chat (session_id, reply, used_files, mode). top: ranking ya calculado."""
     if not message:
         # Sin mensaje: devolver estado de sesión y ficheros
-        return jsonify(
+        return dict(
             session_id=session_id,
             reply=(
                 "Sesión iniciada. Puedes escribir un mensaje o adjuntar un PDF.\n"
-                f"Archivos actuales: {', '.join([n for n, _ in docs]) if docs else '(ninguno)'}"
+                f"Archivos actuales: {', '.join([d['name'] for d in docs]) if docs else '(ninguno)'}"
             ),
             used_files=saved_files,
             mode="status"
@@ -206,14 +2065,16 @@ def chat():
 
     # Si hay documentos, intentar respuesta extractiva
     if docs:
-        hits = extractive_answer(docs, message, top_k=3)
-        if hits:
+        if top is None:
+            with timed("rank"):
+                top = rank_sentences(docs, message, top_k=3, stats=stats)
+        if top:
             reply = (
                 "Esto es lo más relevante que he encontrado en tus documentos:\n\n"
-                f"{hits}\n\n"
+                f"{format_hits(top)}\n\n"
                 "¿Quieres que lo resuma o que busque algo más específico?"
             )
-            return jsonify(session_id=session_id, reply=reply, used_files=saved_files, mode="doc_search")
+            return dict(session_id=session_id, reply=reply, used_files=saved_files, mode="doc_search")
 
         # No hubo coincidencias claras → responder con chat ligero + sugerencias
         base = smalltalk_reply(message)
@@ -222,11 +2083,176 @@ def chat():
             "No encontré coincidencias claras en los PDFs actuales. Si quieres, dime palabras clave más concretas "
             "o adjunta el documento donde conste."
         )
-        return jsonify(session_id=session_id, reply=reply, used_files=saved_files, mode="chat_fallback")
+        return dict(session_id=session_id, reply=reply, used_files=saved_files, mode="chat_fallback")
 
     # No hay documentos → responder en modo “chat”
     reply = smalltalk_reply(message)
-    return jsonify(session_id=session_id, reply=reply, used_files=saved_files, mode="chat")
+    return dict(session_id=session_id, reply=reply, used_files=saved_files, mode="chat")
+
+
+@app.post("/api/chat")
+def chat():
+    """
+    Acepta:
+    - multipart/form-data: fields 'message', 'session_id', y opcional 'files'
+    - application/json:    {"message": "...", "session_id": "..."}
+    Cada respuesta lleva la cabecera Server-Timing con lo que tardó cada etapa
+    (save, ingest, collect, early, rank, total); con ?timings=1 (o "timings": true
+    en el cuerpo) también van en el campo "timings" del JSON.
+    """
+    # 1) Leer message + session_id desde multipart o JSON
+    message, session_id = read_chat_request()
+    try:
+        ses_dir = ensure_session_dir(session_id)
+    except ValueError as ve:
+        return jsonify(error=str(ve)), 400
+    g.timings = {}
+
+    def respond(payload: dict):
+        g.chat_mode = payload["mode"]  # para el histograma de latencia por modo
+        if timings_requested():
+            payload["timings"] = request_timings()
+        return jsonify(payload)
+
+    # 2) Guardar archivos si vienen en multipart
+    saved_files = []
+    fresh = []  # PDFs nuevos aún sin extraer
+    to_ocr = []  # imágenes nuevas: el OCR va siempre en segundo plano
+    for f in uploaded_files():
+        try:
+            with timed("save"):
+                dest = save_file(f, ses_dir)
+            saved_files.append(dest.name)
+        except ValueError as ve:
+            return jsonify(error=str(ve)), 415
+        except QuotaExceeded as qe:
+            return jsonify(error=str(qe)), qe.status
+        if is_image(dest) and indexable(dest) and not document_ready(dest):
+            to_ocr.append(dest)
+        elif message and EARLY_ANSWER_DEADLINE > 0 and dest.suffix.lower() == ".pdf" and not document_ready(dest):
+            fresh.append(dest)
+        else:
+            with timed("ingest"):
+                ingest_file(dest)
+
+    if to_ocr and not fresh:
+        submit_ingest_job(session_id, ses_dir, to_ocr)  # el corpus las incluye cuando termine
+
+    # 3) Cargar corpus de la sesión (para el estado basta con el manifiesto)
+    if not message:
+        with timed("collect"):
+            docs = [{"name": n} for n in sorted(session_files(ses_dir)) if indexable(n)]
+        return respond(chat_payload(session_id, message, docs, saved_files))
+    corpus = get_session_corpus(ses_dir)
+    with timed("collect"):
+        docs = corpus.refresh(only_ready=bool(fresh))
+        # PDFs con la ingesta en curso (los de este turno o de uno anterior): no se
+        # esperan, pero tampoco se dejan fuera de la respuesta
+        indexed = {d["name"] for d in docs}
+        pending = fresh + [ses_dir / n for n in sorted(SessionManifest(ses_dir).files())
+                           if n.lower().endswith(".pdf") and n not in indexed and ses_dir / n not in fresh
+                           and ingest_pending(ses_dir / n)]
+    if pending:
+        # Se recorren página a página (las ya extraídas salen de la caché) hasta tener
+        # la respuesta o agotar el plazo; el resto de la ingesta sigue en segundo plano
+        deadline = time.monotonic() + EARLY_ANSWER_DEADLINE if EARLY_ANSWER_DEADLINE > 0 else None
+        with timed("early"):
+            top = early_answer(message, docs, pending, top_k=3, deadline=deadline, stats=corpus.stats)
+        if fresh:
+            submit_ingest_job(session_id, ses_dir, fresh + to_ocr)
+        docs = docs + [{"name": p.name} for p in pending]
+        return respond(chat_payload(session_id, message, docs, saved_files, top=top))
+
+    # 4) Lógica de respuesta
+    return respond(chat_payload(session_id, message, docs, saved_files, stats=corpus.stats))
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _hit_events(top: List[Hit], provisional: bool):
+    for rank, (score, sent, fname, page) in enumerate(top, 1):
+        yield _sse("hit", {"rank": rank, "score": round(score, 4), "sentence": sent,
+                           "file": fname, "page": page, "provisional": provisional})
+
+
+@app.post("/api/chat/stream")
+def chat_stream():
+    """
+    Variante de /api/chat con Server-Sent Events. Mismas entradas; eventos:
+    session, file_saved (uno por fichero), hit (provisional, con lo ya indexado),
+    document_indexed (uno por documento pendiente de extraer), hit (definitivo)
+    y done, cuyo data es exactamente la respuesta JSON de /api/chat (con
+    "timings" si se piden; aquí no hay cabecera Server-Timing porque se envía
+    antes de empezar). Si una subida no cabe en la cuota el flujo acaba con un
+    evento error.
+    """
+    message, session_id = read_chat_request()
+    files = uploaded_files()
+    for f in files:
+        if not allowed_file(secure_filename(f.filename)):
+            return jsonify(error="Tipo de archivo no permitido (usa .pdf/.png/.jpg/.jpeg)."), 415
+    try:
+        ses_dir = ensure_session_dir(session_id)
+    except ValueError as ve:
+        return jsonify(error=str(ve)), 400
+    want_timings = timings_requested()
+
+    def generate():
+        yield _sse("session", {"session_id": session_id})
+
+        saved_files = []
+        to_ocr = []
+        for f in files:
+            try:
+                with timed("save"):
+                    dest = save_file(f, ses_dir)
+            except QuotaExceeded as qe:
+                yield _sse("error", {"error": str(qe), "status": qe.status})
+                return
+            saved_files.append(dest.name)
+            if is_image(dest) and indexable(dest) and not document_ready(dest):
+                to_ocr.append(dest)
+            yield _sse("file_saved", {"name": dest.name})
+        if to_ocr:
+            submit_ingest_job(session_id, ses_dir, to_ocr)
+
+        corpus = get_session_corpus(ses_dir)
+        # Lo que ya está indexado responde enseguida, antes de extraer lo nuevo
+        ready = corpus.refresh(only_ready=True)
+        pending = [ses_dir / n for n in sorted(session_files(ses_dir)) if n.lower().endswith(".pdf")]
+        pending = [p for p in pending if not document_ready(p) and not ingest_pending(p) and not ingest_failed(p)]
+        if message and pending and ready:
+            yield from _hit_events(rank_sentences(ready, message, top_k=3, stats=corpus.stats), True)
+
+        for p in pending:
+            with timed("ingest"):
+                art = ingest_file(p)
+            yield _sse("document_indexed", {"name": p.name, "sentences": len(art["sentences"]) if art else 0})
+
+        with timed("collect"):
+            docs = corpus.refresh()
+        # PDFs que otro trabajo de ingesta tiene en curso: se leen página a página como en /api/chat
+        indexed = {d["name"] for d in docs}
+        in_flight = [ses_dir / n for n in sorted(SessionManifest(ses_dir).files())
+                     if n.lower().endswith(".pdf") and n not in indexed and ingest_pending(ses_dir / n)]
+        if message and in_flight:
+            deadline = time.monotonic() + EARLY_ANSWER_DEADLINE if EARLY_ANSWER_DEADLINE > 0 else None
+            with timed("early"):
+                top = early_answer(message, docs, in_flight, top_k=3, deadline=deadline, stats=corpus.stats)
+            docs = docs + [{"name": p.name} for p in in_flight]
+        else:
+            with timed("rank"):
+                top = rank_sentences(docs, message, top_k=3, stats=corpus.stats) if message and docs else []
+        yield from _hit_events(top, False)
+        payload = chat_payload(session_id, message, docs, saved_files, top=top)
+        if want_timings:
+            payload["timings"] = request_timings()
+        METRICS.observe("umaer_chat_request_seconds", time.perf_counter() - g.t_start, mode=payload["mode"])
+        yield _sse("done", payload)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 if __name__ == "__main__":
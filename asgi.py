@@ -0,0 +1,173 @@
+"""
+Modo ASGI del backend: mismos endpoints y contratos que la app Flask de app.py.
+
+El cuerpo de cada petición se recibe de forma asíncrona (en memoria y, si
+crece, en disco) sin ocupar ningún hilo, así que cientos de clientes lentos
+subiendo 25 MB solo cuestan sockets abiertos. Cuando la petición está
+completa, la app Flask se ejecuta en un pool de hilos (la extracción de PDFs
+grandes sigue yendo además al pool de procesos de app.py), y la respuesta se
+envía trozo a trozo, de modo que /api/chat/stream también funciona.
+
+Uso:
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app import MAX_CONTENT_LENGTH, app as flask_app
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 16))  # peticiones completas en paralelo
+SPOOL_MAX_MEMORY = 1024 * 1024  # cuerpos mayores se vuelcan a disco
+
+_app_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi-app")
+_io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="asgi-io")
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+async def _read_body(receive, loop):
+    """Cuerpo completo en un SpooledTemporaryFile, o None si el cliente se desconecta."""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    size = 0
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return None, 0
+            chunk = message.get("body", b"")
+            if chunk:
+                size += len(chunk)
+                if size > MAX_CONTENT_LENGTH:
+                    raise _BodyTooLarge()
+                await loop.run_in_executor(_io_executor, body.write, chunk)
+            if not message.get("more_body", False):
+                break
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body, size
+
+
+def _environ(scope, body, size: int) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(size),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        key = "CONTENT_TYPE" if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _run_app(environ: dict, started: asyncio.Future, queue: asyncio.Queue, loop) -> None:
+    """
+    Ejecuta la app Flask en un hilo del pool: publica (status, cabeceras) en
+    `started` y cada trozo del cuerpo en `queue` (None al terminar). Llamada e
+    iteración van en el mismo hilo, como con un worker WSGI: los generadores
+    de Flask (p. ej. el de /api/chat/stream) no pueden cambiar de hilo.
+    """
+    def start_response(status, headers, exc_info=None):
+        loop.call_soon_threadsafe(started.set_result, (status, headers))
+
+    result = None
+    try:
+        result = flask_app(environ, start_response)
+        for chunk in result:
+            loop.call_soon_threadsafe(queue.put_nowait, chunk)
+    finally:
+        try:
+            if hasattr(result, "close"):
+                result.close()
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+
+async def _send_json(send, status: int, data: dict) -> None:
+    payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(payload)).encode())]})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _app_executor.shutdown(wait=False)
+            _io_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    loop = asyncio.get_running_loop()
+    declared = dict(scope.get("headers", [])).get(b"content-length")
+    try:
+        if declared is not None and int(declared) > MAX_CONTENT_LENGTH:
+            raise _BodyTooLarge()
+        body, size = await _read_body(receive, loop)
+    except _BodyTooLarge:
+        return await _send_json(send, 413, {"error": f"La petición supera el máximo de {MAX_CONTENT_LENGTH // (1024 * 1024)} MB."})
+    if body is None:
+        return  # el cliente se fue antes de terminar de enviar
+
+    try:
+        started = loop.create_future()
+        queue: asyncio.Queue = asyncio.Queue()
+        running = loop.run_in_executor(_app_executor, _run_app, _environ(scope, body, size), started, queue, loop)
+        await asyncio.wait({started, running}, return_when=asyncio.FIRST_COMPLETED)
+        if not started.done():
+            running.result()  # la app falló antes de responder: propagar el error
+        status, headers = started.result()
+        await send({
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        })
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await running
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        await loop.run_in_executor(_io_executor, body.close)
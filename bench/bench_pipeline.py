@@ -0,0 +1,190 @@
+"""
+Benchmark del pipeline de extracción y respuesta, etapa a etapa y de punta a
+punta (/api/chat con el test client de Flask), para varios tamaños de corpus.
+
+Etapas (por documento salvo rank y chat):
+    extract   extract_text_from_pdf (PyPDF2; en paralelo a partir de PARALLEL_MIN_PAGES)
+    split     split_sentences sobre el texto extraído
+    tokenize  sentence_terms (tokenize + stopwords) sobre las frases
+    index     build_postings
+    rank      extractive_answer sobre todos los documentos (por pregunta)
+    chat_upload  POST /api/chat multipart: sube un PDF nuevo con pregunta (en
+                 peticiones/s: con respuesta anticipada la petición vuelve antes
+                 de extraer todas las páginas)
+    chat_query   POST /api/chat JSON sobre la sesión ya indexada (por pregunta)
+
+De cada etapa: repeticiones, throughput, p50/p99 de latencia y pico de memoria
+(tracemalloc, medido en una pasada aparte para no falsear las latencias). Los
+PDFs son protocolos sintéticos de synth_corpus.py con semilla fija, así que dos
+ejecuciones son comparables; rank informa además del acierto (hit@k: la
+página del hecho buscado entre las k respuestas).
+Todo se escribe en un directorio temporal (uploads, almacén, trabajos), que
+se borra al terminar.
+
+Uso (desde la raíz del repo):
+    python bench/bench_pipeline.py [--pages 10,50,200] [--docs 3] [--queries 50] [--skew 1.0] [--json]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+ORIG_CWD = Path.cwd()
+WORKDIR = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+os.chdir(WORKDIR)  # app crea uploads/, .store/ y .jobs/ en el directorio actual
+import app  # noqa: E402
+from synth_corpus import make_corpus  # noqa: E402
+
+
+# ---------- Medición ----------
+def measure(name: str, fn, items, unit: str, work=lambda item: 1, mem_item=None) -> dict:
+    """
+    Ejecuta fn(item) para cada item: latencias, throughput (unidades de `work`
+    por segundo) y, en otra pasada sobre mem_item (por defecto el primer item),
+    pico de memoria.
+    """
+    lat = []
+    done = 0
+    t_start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        lat.append((time.perf_counter() - t0) * 1000)
+        done += work(item)
+    elapsed = time.perf_counter() - t_start
+
+    tracemalloc.start()
+    fn(items[0] if mem_item is None else mem_item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lat.sort()
+    return {
+        "stage": name,
+        "n": len(lat),
+        "throughput": round(done / elapsed, 2) if elapsed else None,
+        "unit": unit,
+        "p50_ms": round(statistics.median(lat), 3),
+        "p99_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.99))], 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def wait_jobs(timeout: float = 300) -> None:
+    # Que las ingestas en segundo plano no compitan con la etapa siguiente
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        jobs = [app.read_job(p.stem) for p in app.JOBS_ROOT.glob("*.json")]
+        if all(j is None or j["status"] in ("done", "error") for j in jobs):
+            return
+        time.sleep(0.05)
+
+
+def bench_size(seed: int, n_docs: int, n_pages: int, n_queries: int, top_k: int, skew: float) -> dict:
+    paths, query_set = make_corpus(WORKDIR / "corpus" / f"p{n_pages}", n_docs + 1, n_pages, seed, skew, n_queries)
+    paths, spare = paths[:-1], paths[-1]  # spare: PDF sin ingerir para medir la memoria de una subida
+    query_set = [q for q in query_set if q["file"] != spare.name] or query_set
+    queries = [q["query"] for q in query_set]
+
+    texts = {p: app.extract_text_from_pdf(p) for p in paths}  # calentar el pool de extracción
+    sentences = {p: app.split_sentences(texts[p]) for p in paths}
+    terms = {p: app.sentence_terms(sentences[p]) for p in paths}
+    # Documentos como los de la sesión, con la página de cada frase (para hit@k)
+    arts = {p: app.build_artifact(p, app.file_sha256(p))[0] for p in paths}
+    docs = [app.index_document({"name": p.name, "sentences": arts[p]["sentences"], "pages": arts[p]["pages"],
+                                "terms": arts[p]["terms"]}) for p in paths]
+    stats = app.BM25Stats.from_docs(docs)
+    n_sents = sum(len(s) for s in sentences.values())
+
+    stages = [
+        measure("extract", app.extract_text_from_pdf, paths, "pages/s", lambda p: n_pages),
+        measure("split", lambda p: app.split_sentences(texts[p]), paths, "MB/s",
+                lambda p: len(texts[p].encode("utf-8")) / 1e6),
+        measure("tokenize", lambda p: app.sentence_terms(sentences[p]), paths, "sentences/s",
+                lambda p: len(sentences[p])),
+        measure("index", lambda p: app.build_postings(terms[p]), paths, "sentences/s",
+                lambda p: len(sentences[p])),
+        measure("rank", lambda q: app.extractive_answer(docs, q, top_k, stats), queries, "queries/s"),
+    ]
+    hits = sum(any(fn == q["file"] and page == q["page"]
+                   for _, _, fn, page in app.rank_sentences(docs, q["query"], top_k, stats))
+               for q in query_set)
+    stages[-1][f"hit@{top_k}"] = round(hits / len(query_set), 3)
+
+    # Punta a punta: cada PDF se sube con pregunta a una sesión nueva (respuesta
+    # anticipada si EARLY_ANSWER_DEADLINE > 0; el resto de la ingesta sigue en
+    # segundo plano) y después las preguntas van contra una sesión ya indexada
+    client = app.app.test_client()
+    session = f"bench-p{n_pages}"
+
+    def upload(path: Path):
+        with open(path, "rb") as fh:
+            r = client.post("/api/chat", data={"message": queries[0], "session_id": f"{session}-{path.stem}",
+                                               "files": [(fh, path.name)]}, content_type="multipart/form-data")
+        assert r.status_code == 200, r.status_code
+
+    def ask(question: str):
+        r = client.post("/api/chat", json={"message": question, "session_id": session})
+        assert r.status_code == 200, r.status_code
+
+    stages.append(measure("chat_upload", upload, paths, "requests/s", mem_item=spare))
+    wait_jobs()
+    for path in paths:
+        with open(path, "rb") as fh:
+            client.post("/api/chat", data={"message": "", "session_id": session, "files": [(fh, path.name)]},
+                        content_type="multipart/form-data")
+    stages.append(measure("chat_query", ask, queries, "queries/s"))
+
+    return {"corpus": {"docs": n_docs, "pages_per_doc": n_pages, "sentences": n_sents,
+                       "queries": len(queries), "seed": seed, "skew": skew},
+            "stages": stages}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--pages", default="10,50,200", help="páginas por documento, una ejecución por valor")
+    ap.add_argument("--docs", type=int, default=3, help="documentos por corpus")
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--top-k", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--skew", type=float, default=1.0, help="exponente de Zipf del vocabulario de relleno")
+    ap.add_argument("--json", action="store_true", help="salida en JSON")
+    args = ap.parse_args()
+
+    try:
+        runs = [bench_size(args.seed, args.docs, int(n), args.queries, args.top_k, args.skew)
+                for n in args.pages.split(",")]
+        wait_jobs()  # que ninguna ingesta siga escribiendo en WORKDIR
+    finally:
+        # Las rutas de app son relativas a WORKDIR: volcar ya las métricas pendientes
+        # (si no, el volcado de atexit las escribiría en .metrics/ del directorio original)
+        app.METRICS.flush()
+        os.chdir(ORIG_CWD)
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    report = {
+        "config": {"extract_workers": app.EXTRACT_WORKERS, "parallel_min_pages": app.PARALLEL_MIN_PAGES,
+                   "early_answer_deadline": app.EARLY_ANSWER_DEADLINE, "python": sys.version.split()[0]},
+        "runs": runs,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+    print(f"config: {report['config']}  max_rss_kb={report['max_rss_kb']}")
+    for run in runs:
+        print(f"corpus: {run['corpus']}")
+        for st in run["stages"]:
+            print("  " + "  ".join(f"{k}={v}" for k, v in st.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark del ranking de extractive_answer: scorer anterior (solapamiento de
+términos con score_sentence, recorriendo todas las frases) frente a BM25 sobre
+el índice invertido.
+
+Genera un corpus sintético y reproducible (semilla fija) en el que cada
+pregunta tiene una frase "relevante" plantada con un término raro, rodeada de
+frases con muchos términos frecuentes. Mide latencia por pregunta y calidad
+(acierto en top-1 y MRR@k de la frase plantada).
+
+Uso (desde la raíz del repo):
+    python bench/bench_ranking.py [--docs 10] [--sents 2000] [--queries 200] [--json]
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import app  # noqa: E402
+
+COMMON = (
+    "paciente dosis tratamiento protocolo administrar valorar control urgencia "
+    "signos clínica vigilar monitorizar indicación médico enfermería registro"
+).split()
+RARE = (
+    "adrenalina amiodarona noradrenalina salbutamol midazolam ketamina fentanilo "
+    "naloxona flumazenilo atropina adenosina labetalol nitroglicerina heparina "
+    "ceftriaxona meropenem vancomicina dexametasona hidrocortisona furosemida"
+).split()
+
+
+def make_corpus(rng: random.Random, n_docs: int, n_sents: int, n_queries: int):
+    docs = []
+    for d in range(n_docs):
+        sents = []
+        for _ in range(n_sents):
+            # Frases de relleno: muchos términos frecuentes, algún raro suelto
+            words = rng.choices(COMMON, k=rng.randint(4, 12))
+            if rng.random() < 0.2:
+                words.append(rng.choice(RARE))
+            sents.append(" ".join(words))
+        docs.append({"name": f"doc{d}.pdf", "sentences": sents})
+
+    queries = []
+    for _ in range(n_queries):
+        rare = rng.choice(RARE)
+        common = rng.sample(COMMON, 3)
+        target = f"{rare} {common[0]}"
+        doc = rng.choice(docs)
+        doc["sentences"].insert(rng.randrange(len(doc["sentences"])), target)
+        queries.append((f"{rare} {' '.join(common)}", target))
+    return docs, queries
+
+
+def overlap_answer(docs, question, top_k=3):
+    # Scorer anterior: recorrido lineal + número de términos en común
+    q_terms = app.key_terms(question)
+    candidates = []
+    for doc in docs:
+        for sent in doc["sentences"]:
+            sc = app.score_sentence(sent, q_terms)
+            if sc > 0:
+                candidates.append((sc, sent, doc["name"]))
+    candidates.sort(key=lambda x: (x[0], len(x[1])), reverse=True)
+    return [s for _, s, _ in candidates[:top_k]]
+
+
+def bm25_answer(docs, question, top_k=3, stats=None):
+    hits = app.extractive_answer(docs, question, top_k=top_k, stats=stats) or ""
+    return [line[2:].rsplit("  (", 1)[0] for line in hits.splitlines()]
+
+
+def run(name, fn, queries, top_k):
+    lat, rr, top1 = [], [], 0
+    for question, target in queries:
+        t0 = time.perf_counter()
+        ranked = fn(question, top_k)
+        lat.append((time.perf_counter() - t0) * 1000)
+        rank = ranked.index(target) + 1 if target in ranked else 0
+        rr.append(1 / rank if rank else 0.0)
+        top1 += rank == 1
+    lat.sort()
+    return {
+        "scorer": name,
+        "p50_ms": round(statistics.median(lat), 3),
+        "p99_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.99))], 3),
+        "top1": round(top1 / len(queries), 3),
+        f"mrr@{top_k}": round(statistics.mean(rr), 3),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--docs", type=int, default=10)
+    ap.add_argument("--sents", type=int, default=2000, help="frases por documento")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=13)
+    ap.add_argument("--json", action="store_true", help="salida en JSON")
+    args = ap.parse_args()
+
+    docs, queries = make_corpus(random.Random(args.seed), args.docs, args.sents, args.queries)
+    t0 = time.perf_counter()
+    for doc in docs:
+        app.index_document(doc)
+    stats = app.BM25Stats.from_docs(docs)
+    index_ms = (time.perf_counter() - t0) * 1000
+
+    results = [
+        run("overlap", lambda q, k: overlap_answer(docs, q, k), queries, args.top_k),
+        run("bm25", lambda q, k: bm25_answer(docs, q, k, stats), queries, args.top_k),
+    ]
+    report = {
+        "corpus": {"docs": args.docs, "sentences": sum(len(d["sentences"]) for d in docs),
+                   "queries": args.queries, "seed": args.seed},
+        "index_ms": round(index_ms, 1),
+        "results": results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+    print(f"corpus: {report['corpus']}  (índice: {report['index_ms']} ms)")
+    for r in results:
+        print("  ".join(f"{k}={v}" for k, v in r.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Prueba de carga local del backend: arranca el servidor (gunicorn o uvicorn con
+la configuración de workers que se quiera probar) en un directorio temporal y
+le envía una mezcla de peticiones durante un tiempo fijo:
+
+    chat    POST /api/chat JSON con una pregunta sobre una sesión ya indexada
+    upload  POST /api/chat multipart: un PDF con pregunta en una sesión nueva
+    health  GET /api/health
+
+Los PDFs y las preguntas son los de synth_corpus.py (semilla fija). Dos modos:
+
+    closed  --users clientes, cada uno envía la siguiente petición al recibir la
+            respuesta (más --think segundos): mide cuánto aguanta el servidor
+            con N usuarios.
+    open    llegadas de Poisson a --rate peticiones/s, independientes de lo que
+            tarde el servidor; la latencia se cuenta desde el instante previsto
+            de envío, así que las colas del cliente también cuentan.
+
+Informa, por tipo de petición: nº, throughput, p50/p90/p99/máx de latencia y
+tasa de error (excepción o estado >= 400), y los modos de respuesta de /api/chat.
+El directorio temporal se borra al terminar salvo con --keep.
+
+Uso (desde la raíz del repo):
+    python bench/load_test.py [--server gunicorn|uvicorn] [--workers 2] [--threads 4]
+                              [--mode closed --users 16 | --mode open --rate 50]
+                              [--mix chat=80,upload=5,health=15] [--duration 30] [--json] [--keep]
+    python bench/load_test.py --url http://host:8000 ...   # contra un servidor ya arrancado
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from synth_corpus import make_corpus  # noqa: E402
+
+REPO = Path(__file__).resolve().parent.parent
+KINDS = ("chat", "upload", "health")
+
+
+# ---------- Servidor ----------
+def start_server(kind: str, workers: int, threads: int, port: int, workdir: Path) -> subprocess.Popen:
+    if kind == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "-b", f"127.0.0.1:{port}",
+               "-w", str(workers), "--threads", str(threads), "--timeout", "120"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    env = {**os.environ, "PYTHONPATH": str(REPO)}
+    if kind == "uvicorn":
+        env.setdefault("ASGI_THREADS", str(threads))
+    log = open(workdir / "server.log", "wb")
+    # cwd temporal: uploads/, .store/, .jobs/ y .metrics/ quedan fuera del repo
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_ready(url: str, proc: subprocess.Popen, workdir: Path, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            break
+        try:
+            if requests.get(f"{url}/api/health", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    tail = (workdir / "server.log").read_text(errors="replace")[-2000:] if proc is not None else ""
+    raise SystemExit(f"El servidor no responde en {url}\n{tail}")
+
+
+# ---------- Peticiones ----------
+class Workload:
+    """
+    Corpus y sesiones de la prueba. Cada sesión de consulta recibe un PDF en la
+    preparación (multipart sin mensaje: la ingesta es síncrona), y las preguntas
+    de chat van a la sesión que tiene su respuesta.
+    """
+
+    def __init__(self, url: str, workdir: Path, n_sessions: int, n_pages: int, seed: int):
+        self.url = url
+        paths, queries = make_corpus(workdir / "corpus", n_sessions, n_pages, seed=seed, n_queries=200)
+        self.pdfs = [(p.name, p.read_bytes()) for p in paths]
+        self.sessions = {p.name: f"load-{seed}-{i}" for i, p in enumerate(paths)}
+        self.queries = [(self.sessions[q["file"]], q["query"]) for q in queries]
+
+    def prepare(self) -> None:
+        with requests.Session() as http:
+            for name, data in self.pdfs:
+                r = http.post(f"{self.url}/api/chat", data={"session_id": self.sessions[name]},
+                              files={"files": (name, data, "application/pdf")}, timeout=300)
+                r.raise_for_status()
+
+    def send(self, http: requests.Session, kind: str, rng: random.Random):
+        """Hace una petición del tipo `kind`; devuelve (estado HTTP, modo de la respuesta de chat o None)."""
+        if kind == "health":
+            r = http.get(f"{self.url}/api/health", timeout=60)
+            return r.status_code, None
+        if kind == "chat":
+            session_id, question = rng.choice(self.queries)
+            r = http.post(f"{self.url}/api/chat", json={"message": question, "session_id": session_id}, timeout=120)
+        else:
+            name, data = rng.choice(self.pdfs)
+            session_id = f"load-up-{uuid.uuid4().hex[:12]}"
+            question = rng.choice(self.queries)[1]
+            r = http.post(f"{self.url}/api/chat", data={"message": question, "session_id": session_id},
+                          files={"files": (name, data, "application/pdf")}, timeout=120)
+        mode = None
+        if r.ok:
+            try:
+                mode = r.json().get("mode")
+            except ValueError:
+                pass
+        return r.status_code, mode
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {k: [] for k in KINDS}  # (latencia s, ok)
+        self.statuses = {k: {} for k in KINDS}
+        self.modes: dict = {}
+
+    def add(self, kind: str, latency: float, status, mode) -> None:
+        ok = isinstance(status, int) and status < 400
+        with self._lock:
+            self.samples[kind].append((latency, ok))
+            self.statuses[kind][str(status)] = self.statuses[kind].get(str(status), 0) + 1
+            if mode:
+                self.modes[mode] = self.modes.get(mode, 0) + 1
+
+
+def timed_send(workload: Workload, http: requests.Session, kind: str, rng: random.Random,
+               rec: Recorder, t_sched: float) -> None:
+    try:
+        status, mode = workload.send(http, kind, rng)
+    except requests.RequestException as e:
+        status, mode = type(e).__name__, None
+    rec.add(kind, time.perf_counter() - t_sched, status, mode)
+
+
+def pick(rng: random.Random, mix: dict) -> str:
+    return rng.choices(list(mix), weights=list(mix.values()))[0]
+
+
+# ---------- Modos ----------
+def run_closed(workload: Workload, mix: dict, users: int, duration: float, think: float, seed: int) -> Recorder:
+    rec = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def user(i: int):
+        rng = random.Random(seed * 1000 + i)
+        with requests.Session() as http:
+            while time.perf_counter() < deadline:
+                timed_send(workload, http, pick(rng, mix), rng, rec, time.perf_counter())
+                if think:
+                    time.sleep(rng.expovariate(1 / think))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return rec
+
+def run_open(workload: Workload, mix: dict, rate: float, duration: float, max_inflight: int, seed: int) -> Recorder:
+    rec = Recorder()
+    rng = random.Random(seed)
+    local = threading.local()
+
+    def task(kind: str, t_sched: float, task_seed: int):
+        if not hasattr(local, "http"):
+            local.http = requests.Session()
+        timed_send(workload, local.http, kind, random.Random(task_seed), rec, t_sched)
+
+    with ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="load") as pool:
+        t0 = time.perf_counter()
+        t_next = t0
+        while t_next < t0 + duration:
+            delay = t_next - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, pick(rng, mix), t_next, rng.getrandbits(32))
+            t_next += rng.expovariate(rate)
+    return rec
+
+
+# ---------- Informe ----------
+def summarize(rec: Recorder, elapsed: float) -> dict:
+    out = {}
+    for kind in KINDS:
+        samples = rec.samples[kind]
+        if not samples:
+            continue
+        lat = sorted(s[0] * 1000 for s in samples)
+        errors = sum(1 for s in samples if not s[1])
+
+        def pct(q: float) -> float:
+            return round(lat[min(len(lat) - 1, int(len(lat) * q))], 2)
+
+        out[kind] = {
+            "n": len(lat),
+            "throughput": round(len(lat) / elapsed, 2),
+            "p50_ms": round(statistics.median(lat), 2),
+            "p90_ms": pct(0.90),
+            "p99_ms": pct(0.99),
+            "max_ms": round(lat[-1], 2),
+            "errors": errors,
+            "error_rate": round(errors / len(lat), 4),
+            "statuses": rec.statuses[kind],
+        }
+    return out
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in KINDS:
+            raise SystemExit(f"Tipo de petición desconocido en --mix: {kind!r} (usa {', '.join(KINDS)})")
+        mix[kind.strip()] = float(weight or 1)
+    return {k: w for k, w in mix.items() if w > 0}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--url", help="servidor ya arrancado (si no, se arranca uno local)")
+    ap.add_argument("--server", choices=("gunicorn", "uvicorn"), default="gunicorn")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=4, help="hilos por worker (gunicorn) o ASGI_THREADS (uvicorn)")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--mode", choices=("closed", "open"), default="closed")
+    ap.add_argument("--users", type=int, default=16, help="clientes concurrentes (closed)")
+    ap.add_argument("--think", type=float, default=0.0, help="pausa media entre peticiones de un cliente, s (closed)")
+    ap.add_argument("--rate", type=float, default=20.0, help="peticiones/s (open)")
+    ap.add_argument("--max-inflight", type=int, default=256, help="peticiones simultáneas como mucho (open)")
+    ap.add_argument("--mix", default="chat=80,upload=5,health=15", help="pesos por tipo de petición")
+    ap.add_argument("--duration", type=float, default=30.0, help="s de carga")
+    ap.add_argument("--sessions", type=int, default=4, help="sesiones (una por PDF) para las preguntas")
+    ap.add_argument("--pages", type=int, default=20, help="páginas por PDF")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", action="store_true", help="salida en JSON")
+    ap.add_argument("--keep", action="store_true",
+                    help="no borrar el directorio temporal (server.log, uploads, almacén)")
+    args = ap.parse_args()
+    mix = parse_mix(args.mix)
+
+    workdir = Path(tempfile.mkdtemp(prefix="load_test_"))
+    proc = None
+    url = (args.url or f"http://127.0.0.1:{args.port}").rstrip("/")
+    try:
+        if not args.url:
+            proc = start_server(args.server, args.workers, args.threads, args.port, workdir)
+        wait_ready(url, proc, workdir)
+        workload = Workload(url, workdir, args.sessions, args.pages, args.seed)
+        workload.prepare()
+
+        t0 = time.perf_counter()
+        if args.mode == "closed":
+            rec = run_closed(workload, mix, args.users, args.duration, args.think, args.seed)
+        else:
+            rec = run_open(workload, mix, args.rate, args.duration, args.max_inflight, args.seed)
+        elapsed = time.perf_counter() - t0
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        if args.keep:
+            print(f"directorio de trabajo: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    per_kind = summarize(rec, elapsed)
+    total = sum(k["n"] for k in per_kind.values())
+    report = {
+        "config": {"url": url, "server": None if args.url else args.server, "workers": args.workers,
+                   "threads": args.threads, "mode": args.mode, "mix": mix, "duration": args.duration,
+                   **({"users": args.users, "think": args.think} if args.mode == "closed" else
+                      {"rate": args.rate, "max_inflight": args.max_inflight}),
+                   "sessions": args.sessions, "pages": args.pages, "seed": args.seed},
+        "elapsed_s": round(elapsed, 2),
+        "throughput": round(total / elapsed, 2) if elapsed else None,
+        "error_rate": round(sum(k["errors"] for k in per_kind.values()) / total, 4) if total else None,
+        "kinds": per_kind,
+        "chat_modes": rec.modes,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+    print(f"config: {report['config']}")
+    print(f"total: n={total}  throughput={report['throughput']}/s  error_rate={report['error_rate']}"
+          f"  elapsed_s={report['elapsed_s']}")
+    for kind, st in per_kind.items():
+        print(f"  kind={kind}  " + "  ".join(f"{k}={v}" for k, v in st.items()))
+    print(f"chat modes: {rec.modes}")
+
+
+if __name__ == "__main__":
+    main()
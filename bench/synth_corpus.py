@@ -0,0 +1,222 @@
+"""
+Generador determinista de PDFs sintéticos con aspecto de protocolo clínico en
+español (encabezados numerados, párrafos, posologías tipo "0.5 mg/kg", tablas
+de dosificación) y de las preguntas que les corresponden. Sin datos reales de
+pacientes: todo sale de listas de vocabulario y plantillas con una semilla.
+
+Cada documento lleva "hechos" plantados (fármaco + situación + dosis, en una
+línea) y cada pregunta apunta a uno de ellos con el fichero y la página donde
+está. El vocabulario de relleno se elige con una distribución de Zipf de
+exponente `skew`: a más skew, más se repiten los términos frecuentes.
+
+El PDF se escribe a mano (Helvetica, WinAnsiEncoding; texto en latin-1), así
+que no hace falta ninguna dependencia además de PyPDF2 para leerlo.
+
+Uso (desde la raíz del repo):
+    python bench/synth_corpus.py --out /tmp/corpus [--docs 5] [--pages 200] [--skew 1.1] [--queries 100] [--seed 7]
+Escribe los PDFs y queries.json ([{"query", "file", "page", "answer"}]) en --out.
+"""
+import argparse
+import bisect
+import itertools
+import json
+import random
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+DRUGS = (
+    "adrenalina noradrenalina amiodarona atropina adenosina midazolam ketamina fentanilo morfina "
+    "naloxona flumazenilo salbutamol ipratropio dexametasona hidrocortisona metilprednisolona "
+    "furosemida labetalol nitroglicerina heparina enoxaparina ceftriaxona meropenem vancomicina "
+    "paracetamol ibuprofeno metamizol ondansetrón omeprazol insulina glucosa bicarbonato magnesio "
+    "calcio propofol rocuronio succinilcolina diazepam levetiracetam fenitoína"
+).split()
+CONDITIONS = [
+    "parada cardiorrespiratoria", "shock séptico", "anafilaxia", "crisis asmática grave",
+    "estatus epiléptico", "síndrome coronario agudo", "hipoglucemia grave", "cetoacidosis diabética",
+    "politraumatismo", "gran quemado", "bronquiolitis", "intoxicación por opiáceos",
+    "edema agudo de pulmón", "fibrilación auricular rápida", "hemorragia digestiva alta",
+    "ictus isquémico", "crisis hipertensiva", "dolor torácico", "sedación para procedimientos",
+    "intubación de secuencia rápida", "meningitis bacteriana", "deshidratación grave",
+]
+ROUTES = ["intravenosa", "intramuscular", "subcutánea", "oral", "inhalada", "intraósea", "nebulizada", "rectal"]
+FREQS = ["cada 4 horas", "cada 6 horas", "cada 8 horas", "cada 12 horas", "en dosis única",
+         "en perfusión continua", "cada 3 a 5 minutos", "según respuesta clínica"]
+UNITS = ["mg/kg", "mcg/kg", "mg", "mcg/kg/min", "ml/kg", "UI/kg", "g"]
+SECTIONS = ["Objetivo", "Ámbito de aplicación", "Definiciones", "Valoración inicial", "Tratamiento inicial",
+            "Tratamiento de mantenimiento", "Criterios de ingreso", "Criterios de derivación",
+            "Monitorización", "Consideraciones en pediatría", "Complicaciones", "Registro y seguimiento"]
+# Relleno ordenado de más a menos frecuente (rango de Zipf)
+FILLER = (
+    "paciente valoración monitorización constantes saturación oxígeno ventilación vía aérea acceso "
+    "venoso analítica gasometría electrocardiograma tensión arterial frecuencia cardiaca temperatura "
+    "glucemia diuresis escala equipo enfermería pediatría urgencias adulto niño lactante peso edad "
+    "alergias antecedentes criterios ingreso alta derivación traslado reevaluación respuesta clínica "
+    "protocolo indicación contraindicación riesgo beneficio familia consentimiento registro historia "
+    "exploración auscultación perfusión capilar conciencia dolor sedación analgesia fluidoterapia "
+    "cristaloides hemocultivos lactato radiografía ecografía tomografía interconsulta especialista"
+).split()
+TEMPLATES = [
+    "Se recomienda {a} y {b} en todo paciente con {cond}.",
+    "Valorar {a}, {b} y {c} cada {n} minutos durante la fase inicial.",
+    "Ante {cond}, priorizar {a} antes de {b}.",
+    "El {a} debe quedar reflejado en la historia junto con {b}.",
+    "Si no hay mejoría, repetir {a} y avisar al {b}.",
+    "En {cond} la {a} guía la decisión sobre {b} y {c}.",
+    "Comprobar {a} y {b} antes de cualquier traslado.",
+    "La {a} se realiza según el protocolo de {b} del centro.",
+]
+LINES_PER_PAGE = 60
+LINE_WIDTH = 95
+
+
+# ---------- PDF ----------
+def _pdf_string(line: str) -> bytes:
+    return b"(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1") + b")"
+
+def write_pdf(path: Path, pages: List[List[str]]) -> None:
+    """PDF sin comprimir con una línea de texto por elemento de cada página (latin-1)."""
+    objs: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objs.append(body)
+        return len(objs)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    pages_id = len(objs) + 1 + 2 * len(pages)
+    kids = []
+    for lines in pages:
+        stream = b"BT /F1 9 Tf 12.5 TL 40 800 Td " + b"".join(_pdf_string(l) + b" Tj T* " for l in lines) + b"ET"
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+                        b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content, font)))
+    add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids)))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, catalog, xref)
+    path.write_bytes(bytes(out))
+
+
+# ---------- Texto ----------
+class Zipf:
+    """Muestreo de FILLER con probabilidad proporcional a 1 / rango^skew."""
+
+    def __init__(self, rng: random.Random, words: List[str], skew: float):
+        self.rng, self.words = rng, words
+        self.cum = list(itertools.accumulate(1 / (r ** skew) for r in range(1, len(words) + 1)))
+
+    def __call__(self) -> str:
+        return self.words[bisect.bisect(self.cum, self.rng.random() * self.cum[-1])]
+
+
+def _dose(rng: random.Random) -> str:
+    return rng.choice(["0.01", "0.05", "0.1", "0.2", "0.5", "1", "2", "5", "10", "15", "20"]) + " " + rng.choice(UNITS)
+
+def _wrap(text: str) -> List[str]:
+    lines, cur = [], ""
+    for word in text.split():
+        if cur and len(cur) + 1 + len(word) > LINE_WIDTH:
+            lines.append(cur)
+            cur = word
+        else:
+            cur = f"{cur} {word}" if cur else word
+    if cur:
+        lines.append(cur)
+    return lines
+
+def _paragraph(rng: random.Random, filler: Zipf) -> List[str]:
+    sents = []
+    for _ in range(rng.randint(2, 5)):
+        sents.append(rng.choice(TEMPLATES).format(a=filler(), b=filler(), c=filler(), n=rng.choice([5, 10, 15, 30]),
+                                                  cond=rng.choice(CONDITIONS)))
+    return _wrap(" ".join(sents))
+
+def _table(rng: random.Random, number: int) -> List[str]:
+    rows = [f"Tabla {number}. Dosificación orientativa", f"{'Fármaco':<18}{'Dosis':<18}{'Vía':<16}Frecuencia"]
+    for drug in rng.sample(DRUGS, rng.randint(4, 8)):
+        rows.append(f"{drug.capitalize():<18}{_dose(rng):<18}{rng.choice(ROUTES):<16}{rng.choice(FREQS)}")
+    return rows
+
+def _fact(rng: random.Random, drug: str, cond: str) -> str:
+    # Una sola línea: es la frase que debería devolver la pregunta correspondiente
+    return (f"Dosis de {drug} en {cond}: {_dose(rng)} por vía {rng.choice(ROUTES)} {rng.choice(FREQS)}")
+
+def make_document(rng: random.Random, n_pages: int, skew: float, facts: List[Tuple[str, str]]) -> Tuple[List[List[str]], Dict[Tuple[str, str], Tuple[int, str]]]:
+    """
+    Páginas de un documento (listas de líneas) y, por cada hecho (fármaco,
+    situación), la página (desde 1) y la línea donde quedó escrito.
+    """
+    filler = Zipf(rng, FILLER, skew)
+    fact_pages = {fact: rng.randrange(n_pages) for fact in facts}
+    placed: Dict[Tuple[str, str], Tuple[int, str]] = {}
+    pages, section, tables = [], 0, 0
+    for p in range(n_pages):
+        lines = [f"Protocolo {rng.choice(CONDITIONS)} - página {p + 1}", ""]
+        here = [f for f, fp in fact_pages.items() if fp == p]
+        for fact in here:
+            line = _fact(rng, *fact)
+            placed[fact] = (p + 1, line)
+            lines += [line, ""]
+        while len(lines) < LINES_PER_PAGE:
+            roll = rng.random()
+            if roll < 0.12:
+                section += 1
+                lines += ["", f"{section}. {SECTIONS[(section - 1) % len(SECTIONS)]}"]
+            elif roll < 0.2:
+                tables += 1
+                lines += _table(rng, tables) + [""]
+            else:
+                lines += _paragraph(rng, filler)
+        pages.append(lines[:max(LINES_PER_PAGE, 2 + 2 * len(here))])  # los hechos van arriba: nunca se recortan
+    return pages, placed
+
+def make_corpus(out_dir: Path, n_docs: int, n_pages: int, seed: int = 7, skew: float = 1.0,
+                n_queries: int = 100) -> Tuple[List[Path], List[dict]]:
+    """
+    Escribe n_docs PDFs de n_pages páginas en out_dir y devuelve (rutas,
+    preguntas). Cada pregunta es {"query", "file", "page", "answer"}.
+    """
+    rng = random.Random(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    combos = [(d, c) for d in DRUGS for c in CONDITIONS]
+    rng.shuffle(combos)
+    per_doc = max(1, -(-n_queries // max(1, n_docs)))  # ceil
+    paths, queries = [], []
+    for d in range(n_docs):
+        facts, combos = combos[:per_doc], combos[per_doc:] or combos
+        pages, placed = make_document(rng, n_pages, skew, facts)
+        path = out_dir / f"protocolo_{d:03d}.pdf"
+        write_pdf(path, pages)
+        paths.append(path)
+        for (drug, cond), (page, line) in placed.items():
+            queries.append({"query": f"dosis de {drug} en {cond}", "file": path.name, "page": page, "answer": line})
+    rng.shuffle(queries)
+    return paths, queries[:n_queries]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--out", type=Path, required=True, help="directorio de salida")
+    ap.add_argument("--docs", type=int, default=5)
+    ap.add_argument("--pages", type=int, default=200, help="páginas por documento")
+    ap.add_argument("--skew", type=float, default=1.0, help="exponente de Zipf del vocabulario de relleno")
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    paths, queries = make_corpus(args.out, args.docs, args.pages, args.seed, args.skew, args.queries)
+    (args.out / "queries.json").write_text(json.dumps(queries, indent=2, ensure_ascii=False), encoding="utf-8")
+    size = sum(p.stat().st_size for p in paths)
+    print(f"{len(paths)} PDFs ({args.pages} páginas, {size / 1e6:.1f} MB) y {len(queries)} preguntas en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Base de los tests: app.py crea uploads/, .store/ y .jobs/ en el directorio
+actual, así que cada test corre en un directorio temporal propio.
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+_BASE = tempfile.mkdtemp(prefix="umaer_tests_")
+os.chdir(_BASE)  # antes de importar app
+import app  # noqa: E402
+from synth_corpus import write_pdf  # noqa: E402
+
+app.GC_INTERVAL = 0  # sin barrendero en segundo plano
+
+
+def pdf_bytes(pages: List[List[str]]) -> bytes:
+    path = Path(tempfile.mkdtemp(prefix="pdf_")) / "doc.pdf"
+    write_pdf(path, pages)
+    data = path.read_bytes()
+    shutil.rmtree(path.parent)
+    return data
+
+
+class AppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="case_", dir=_BASE)
+        os.chdir(self.workdir)
+        for root in (app.UPLOAD_ROOT, app.STORE_ROOT, app.JOBS_ROOT):
+            root.mkdir(parents=True, exist_ok=True)
+        app._corpora.clear()
+        self.client = app.app.test_client()
+
+    def tearDown(self):
+        os.chdir(_BASE)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def patch(self, name: str, value) -> None:
+        """Cambia una constante de app.py durante el test."""
+        old = getattr(app, name)
+        setattr(app, name, value)
+        self.addCleanup(setattr, app, name, old)
+
+    def upload(self, session_id: str, name: str, data: bytes, message: str = ""):
+        return self.client.post("/api/chat", data={"message": message, "session_id": session_id,
+                                                   "files": [(io.BytesIO(data), name)]},
+                                content_type="multipart/form-data")
+
+    def ask(self, session_id: str, message: str):
+        return self.client.post("/api/chat", json={"message": message, "session_id": session_id})
+
+    def age_session(self, session_id: str, seconds: float) -> None:
+        # El último uso de una sesión es el mtime de su directorio
+        ses = app.UPLOAD_ROOT / session_id
+        t = os.stat(ses).st_mtime - seconds
+        os.utime(ses, (t, t))
@@ -0,0 +1,87 @@
+import io
+import json
+import threading
+import time
+
+from tests.support import AppTestCase, app, pdf_bytes
+
+PAGES = [[f"Página {i + 1} con texto de relleno sobre vigilancia y registro."] for i in range(30)]
+PAGES[0] = ["La dosis de adrenalina en anafilaxia es 0,5 mg intramuscular."]
+PAGES[24] = ["El midazolam bucal se usa en la crisis convulsiva prolongada."]
+LONG_PDF = pdf_bytes(PAGES)
+
+
+class PendingIngestTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        # Trabajos de ingesta retenidos: el PDF sigue "pending" hasta release()
+        self.gate = threading.Event()
+        self.addCleanup(self.gate.set)
+        run = app._run_ingest_job
+
+        def held(*args):
+            self.gate.wait(30)
+            run(*args)
+
+        self.patch("_run_ingest_job", held)
+
+    def release(self):
+        self.gate.set()
+        deadline = time.monotonic() + 10
+        while not app.document_ready(app.UPLOAD_ROOT / "s" / "p.pdf") and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+    def test_pending_pdf_still_answers_on_later_turns(self):
+        r = self.upload("s", "p.pdf", LONG_PDF, message="dosis de adrenalina")
+        self.assertEqual(r.json["mode"], "doc_search")
+        self.assertIn("pending_since", app.SessionManifest(app.UPLOAD_ROOT / "s").files()["p.pdf"])
+
+        r = self.ask("s", "midazolam en la crisis convulsiva")
+        self.assertEqual(r.json["mode"], "doc_search")
+        self.assertIn("(p.pdf, pág. 25)", r.json["reply"])
+        self.assertIn("p.pdf", self.ask("s", "").json["reply"])
+
+        self.release()
+        r = self.ask("s", "midazolam en la crisis convulsiva")
+        self.assertEqual(r.json["mode"], "doc_search")
+        self.assertIn("(p.pdf, pág. 25)", r.json["reply"])
+
+    def test_stream_answers_from_pending_pdf(self):
+        self.upload("s", "p.pdf", LONG_PDF, message="dosis de adrenalina")
+        r = self.client.post("/api/chat/stream", json={"message": "midazolam bucal", "session_id": "s"})
+        done = [e for e in r.data.decode().split("\n\n") if e.startswith("event: done")]
+        payload = json.loads(done[0].split("data: ", 1)[1])
+        self.assertEqual(payload["mode"], "doc_search")
+        self.assertIn("pág. 25", payload["reply"])
+
+
+class JobProgressTests(AppTestCase):
+    def test_cached_artifact_reports_all_pages_done(self):
+        data = pdf_bytes([["Primera página."], ["Segunda página."], ["Tercera página."]])
+        for session in ("a", "b"):  # en "b" el artefacto ya está en caché
+            r = self.client.post(f"/api/sessions/{session}/files",
+                                 data={"files": [(io.BytesIO(data), "p.pdf")]}, content_type="multipart/form-data")
+            self.assertEqual(r.status_code, 202)
+            job_id = r.json["job_id"]
+            deadline = time.monotonic() + 10
+            while app.read_job(job_id)["status"] not in ("done", "error") and time.monotonic() < deadline:
+                time.sleep(0.02)
+            job = self.client.get(f"/api/jobs/{job_id}").json
+            self.assertEqual(job["status"], "done")
+            self.assertEqual((job["files"][0]["pages_done"], job["files"][0]["pages_total"]), (3, 3))
+
+
+class SessionIdTests(AppTestCase):
+    def test_rejects_ids_outside_upload_root(self):
+        data = pdf_bytes([["Primera página."]])
+        r = self.client.post("/api/sessions/%2E%2E/files",
+                             data={"files": [(io.BytesIO(data), "p.pdf")]}, content_type="multipart/form-data")
+        self.assertEqual(r.status_code, 400)
+        for session in ("..", "a/b", "x" * 65, 7):
+            r = self.client.post("/api/chat", json={"message": "hola", "session_id": session})
+            self.assertEqual(r.status_code, 400, session)
+            r = self.client.post("/api/chat/stream", json={"message": "hola", "session_id": session})
+            self.assertEqual(r.status_code, 400, session)
+        self.assertFalse((app.UPLOAD_ROOT.parent / "p.pdf").exists())
+        self.assertFalse((app.UPLOAD_ROOT.parent / app.MANIFEST_FILENAME).exists())
+        self.assertEqual(self.ask("sesion-1_a", "hola").status_code, 200)
@@ -0,0 +1,125 @@
+import random
+import struct
+from pathlib import Path
+
+from tests.support import AppTestCase, app, pdf_bytes
+
+SENTENCES = [
+    ["La adrenalina se administra por vía intramuscular en la anafilaxia.",
+     "En la parada cardiaca la adrenalina va por vía intravenosa cada cuatro minutos.",
+     "Vigilar la tensión arterial tras la administración."],
+    ["El salbutamol nebulizado alivia la crisis asmática.",
+     "La amiodarona se usa en la fibrilación ventricular refractaria.",
+     "Registrar la dosis de salbutamol en la hoja de enfermería."],
+]
+
+
+def make_docs():
+    docs = []
+    for i, sents in enumerate(SENTENCES):
+        doc = {"name": f"d{i}.pdf", "sha256": f"{i:064x}", "size": 100 + i, "mtime_ns": 1000 + i,
+               "sentences": list(sents), "pages": list(range(len(sents))), "offsets": [7 * j for j in range(len(sents))]}
+        docs.append(app.index_document(doc))
+    return docs
+
+
+class IndexTests(AppTestCase):
+    def write_and_open(self, docs):
+        path = app.UPLOAD_ROOT / app.INDEX_FILENAME
+        with app.VOCAB.use():
+            app.write_session_index(path, docs, app.BM25Stats.from_docs(docs))
+        return path, app.SessionIndex(path)
+
+    def test_round_trip(self):
+        docs = make_docs()
+        _, index = self.write_and_open(docs)
+        self.assertEqual(index.files, {d["name"]: (d["size"], d["mtime_ns"]) for d in docs})
+        with app.VOCAB.use():
+            stats = app.BM25Stats.from_docs(docs)
+            self.assertEqual((index.stats.n_sents, index.stats.total_len), (stats.n_sents, stats.total_len))
+            self.assertEqual(dict(index.stats.df.items()), stats.df)
+            for mem, disk in zip(docs, index.docs):
+                self.assertEqual(disk["name"], mem["name"])
+                self.assertEqual(list(disk["sentences"]), mem["sentences"])
+                self.assertEqual(list(disk["pages"]), mem["pages"])
+                self.assertEqual(list(disk["offsets"]), mem["offsets"])
+                self.assertEqual(list(disk["lengths"]), list(mem["lengths"]))
+                self.assertEqual({t: (list(s), list(f)) for t, (s, f) in disk["postings"].items()},
+                                 {t: (list(s), list(f)) for t, (s, f) in mem["postings"].items()})
+
+    def test_ranking_matches_in_memory_index(self):
+        docs = make_docs()
+        _, index = self.write_and_open(docs)
+        for q in ("adrenalina intravenosa", "dosis de salbutamol", "amiodarona", "vía", "nada que ver"):
+            self.assertEqual(app.rank_sentences(index.docs, q, 3, index.stats), app.rank_sentences(docs, q, 3))
+        top = app.rank_sentences(index.docs, "parada cardiaca adrenalina", 1, index.stats)
+        self.assertEqual(top[0][1:], (SENTENCES[0][1], "d0.pdf", 2))
+
+    def test_rejects_other_versions(self):
+        path, _ = self.write_and_open(make_docs())
+        raw = bytearray(path.read_bytes())
+        struct.pack_into("<I", raw, 4, app.INDEX_VERSION + 1)
+        path.write_bytes(bytes(raw))
+        with self.assertRaises(ValueError):
+            app.SessionIndex(path)
+
+    def test_queries_do_not_grow_vocabulary(self):
+        _, index = self.write_and_open(make_docs())
+        app.rank_sentences(index.docs, "adrenalina", 3, index.stats)
+        before = len(app.VOCAB.terms)
+        rng = random.Random(1)
+        for _ in range(200):
+            q = " ".join("".join(rng.choice("abcdefghij") for _ in range(8)) for _ in range(5))
+            app.rank_sentences(index.docs, q, 3, index.stats)
+            app.early_answer(q, index.docs, [])
+        self.assertEqual(len(app.VOCAB.terms), before)
+
+    def test_vocabulary_is_reset_when_over_limit_and_ranking_still_works(self):
+        _, index = self.write_and_open(make_docs())
+        expected = app.rank_sentences(index.docs, "salbutamol nebulizado", 2, index.stats)
+        self.patch("VOCAB", app.Vocabulary(max_terms=1))
+        self.assertEqual(app.rank_sentences(index.docs, "salbutamol nebulizado", 2, index.stats), expected)
+        self.assertEqual(app.VOCAB.terms, [])  # vaciado al salir del último bloque
+
+    def test_session_index_after_upload(self):
+        data = pdf_bytes([["Primera página sin nada."], ["La noradrenalina se usa en el shock séptico."]])
+        self.upload("s", "n.pdf", data)
+        docs = app.collect_session_docs(app.UPLOAD_ROOT / "s")
+        top = app.rank_sentences(docs, "noradrenalina shock", 1)
+        self.assertEqual(top[0][2:], ("n.pdf", 2))
+
+
+class EarlyAnswerTests(AppTestCase):
+    # Muchas frases con los términos comunes y una sola con el término raro: por nº de
+    # términos ganan las comunes, por BM25 la rara
+    COMMON = [f"El paciente {i} sigue en vigilancia estrecha." for i in range(19)]
+    RARE = "Se administra midazolam bucal."
+
+    def indexed_docs(self):
+        sents = self.COMMON + [self.RARE]
+        doc = {"name": "indexado.pdf", "sentences": sents, "pages": [0] * len(sents), "offsets": [0] * len(sents)}
+        return [app.index_document(doc)]
+
+    def pending_pdf(self, pages) -> Path:
+        path = Path(self.workdir) / "pendiente.pdf"
+        path.write_bytes(pdf_bytes(pages))
+        return path
+
+    def test_indexed_documents_keep_bm25_order(self):
+        docs = self.indexed_docs()
+        q = "paciente vigilancia midazolam"
+        pending = self.pending_pdf([["Nada que ver con la pregunta."]])
+        with app.VOCAB.use():
+            stats = app.BM25Stats.from_docs(docs)
+            expected = app.rank_sentences(docs, q, 3, stats)
+            self.assertEqual(expected[0][1], self.RARE)
+            self.assertEqual(app.early_answer(q, docs, [pending], 3, stats=stats), expected)
+
+    def test_pending_hits_are_merged_by_bm25(self):
+        docs = self.indexed_docs()
+        pending = self.pending_pdf([["Relleno sin interés."], ["El midazolam bucal corta la crisis convulsiva."]])
+        with app.VOCAB.use():
+            stats = app.BM25Stats.from_docs(docs)
+            top = app.early_answer("midazolam convulsiva", docs, [pending], 2, stats=stats)
+        self.assertEqual([(fn, page) for _, _, fn, page in top], [("pendiente.pdf", 2), ("indexado.pdf", 1)])
+        self.assertGreater(top[0][0], top[1][0])
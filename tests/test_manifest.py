@@ -0,0 +1,67 @@
+import os
+
+from tests.support import AppTestCase, app, pdf_bytes
+
+PDF_A = pdf_bytes([["La dosis de adrenalina en anafilaxia es 0,5 mg intramuscular."]])
+PDF_B = pdf_bytes([["El salbutamol se nebuliza cada veinte minutos en la crisis asmática."]])
+
+
+class ManifestTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.upload("s", "a.pdf", PDF_A)
+        self.upload("s", "b.pdf", PDF_B)
+        self.ses = app.UPLOAD_ROOT / "s"
+
+    def test_upload_is_recorded_ready(self):
+        files = app.SessionManifest(self.ses).files()
+        self.assertEqual(sorted(files), ["a.pdf", "b.pdf"])
+        entry = files["a.pdf"]
+        self.assertEqual(entry["sha256"], app.file_sha256(self.ses / "a.pdf"))
+        self.assertEqual(entry["size"], len(PDF_A))
+        self.assertEqual(entry["status"], "ready")
+        self.assertEqual((entry["parser"], entry["index_version"]), (app.PARSER_VERSION, app.INDEX_VERSION))
+
+    def test_deleted_file_leaves_listing_index_and_usage(self):
+        self.assertEqual(self.ask("s", "dosis de adrenalina").json["mode"], "doc_search")
+        digest = app.file_sha256(self.ses / "a.pdf")
+        os.unlink(self.ses / "a.pdf")
+
+        status = self.ask("s", "").json["reply"]
+        self.assertNotIn("a.pdf", status)
+        self.assertIn("b.pdf", status)
+        self.assertNotIn("a.pdf", app.SessionManifest(self.ses).files())
+        self.assertNotIn("a.pdf", self.ask("s", "dosis de adrenalina anafilaxia").json["reply"])
+        self.assertEqual([d["name"] for d in app.collect_session_docs(self.ses)], ["b.pdf"])
+        usage = app.USAGE.read()
+        self.assertEqual(usage["sessions"]["s"], len(PDF_B))
+        self.assertEqual(usage["store_bytes"], len(PDF_B))
+        self.assertFalse(app._blob_path(digest).exists())
+
+    def test_deleted_file_is_dropped_from_index_without_listing_first(self):
+        self.ask("s", "dosis de adrenalina")
+        os.unlink(self.ses / "a.pdf")
+        app._corpora.clear()  # otro worker: solo ve el índice en disco
+        self.assertEqual([d["name"] for d in app.collect_session_docs(self.ses)], ["b.pdf"])
+
+    def test_file_replaced_outside_save_file_is_reingested(self):
+        os.unlink(self.ses / "a.pdf")
+        new = pdf_bytes([["La amiodarona se administra en bolo de 300 mg en la parada."]])
+        (self.ses / "a.pdf").write_bytes(new)
+        reply = self.ask("s", "amiodarona en bolo").json
+        self.assertEqual(reply["mode"], "doc_search")
+        self.assertIn("a.pdf", reply["reply"])
+        entry = app.SessionManifest(self.ses).files()["a.pdf"]
+        self.assertEqual(entry["sha256"], app.file_sha256(self.ses / "a.pdf"))
+        self.assertEqual(app.USAGE.read()["sessions"]["s"], len(new) + len(PDF_B))
+
+    def test_remove(self):
+        entry = app.SessionManifest(self.ses).remove("a.pdf")
+        self.assertEqual(entry["size"], len(PDF_A))
+        self.assertIsNone(app.SessionManifest(self.ses).remove("a.pdf"))
+        self.assertEqual(sorted(app.SessionManifest(self.ses).files()), ["b.pdf"])
+
+    def test_missing_manifest_is_rebuilt_from_directory(self):
+        os.unlink(self.ses / app.MANIFEST_FILENAME)
+        self.assertEqual(sorted(app.SessionManifest(self.ses).files()), ["a.pdf", "b.pdf"])
+        self.assertEqual(self.ask("s", "salbutamol nebuliza").json["mode"], "doc_search")
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from tests.support import AppTestCase, app, pdf_bytes
+
+PAGES = [["La adrenalina se administra por vía intramuscular."],
+         ["El salbutamol nebulizado alivia la crisis asmática."],
+         ["La amiodarona se usa en la fibrilación ventricular."]]
+
+
+def extracted(kind: str = "pdf") -> float:
+    return app.METRICS.counters.get(f"umaer_extracted_pages_total{{kind=\"{kind}\"}}", 0)
+
+
+class ExtractMetricsTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pdf = Path(self.workdir) / "doc.pdf"
+        self.pdf.write_bytes(pdf_bytes(PAGES))
+        self.digest = app.file_sha256(self.pdf)
+
+    def check_cached_pages_not_counted(self):
+        before = extracted()
+        art, ok = app.build_artifact(self.pdf, self.digest)
+        self.assertTrue(ok)
+        self.assertEqual(extracted() - before, len(PAGES))
+        # Segunda vez: todas las páginas salen de la caché del almacén
+        art2, _ = app.build_artifact(self.pdf, self.digest)
+        self.assertEqual(art2["text"], art["text"])
+        self.assertEqual(extracted() - before, len(PAGES))
+
+    def test_serial(self):
+        self.patch("EXTRACT_WORKERS", 1)
+        self.check_cached_pages_not_counted()
+
+    def test_parallel(self):
+        self.patch("EXTRACT_WORKERS", 2)
+        self.patch("PARALLEL_MIN_PAGES", 1)
+        self.check_cached_pages_not_counted()
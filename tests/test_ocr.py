@@ -0,0 +1,87 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from tests.support import AppTestCase, app
+
+IMAGE = "Protocolo fotografiado.\nLa vasopresina se reserva para el shock refractario.\n".encode()
+
+
+class OcrTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bin = Path(tempfile.mkdtemp(dir=self.workdir))
+        self.calls = self.bin / "calls.log"
+        self.reset_ocr()
+        self.addCleanup(self.reset_ocr)
+
+    def reset_ocr(self):
+        # El pool de OCR hereda TESSERACT_CMD al crearse; la disponibilidad se cachea
+        if app._ocr_pool is not None:
+            app._ocr_pool.shutdown()
+            app._ocr_pool = None
+        app._ocr_available.cache_clear()
+
+    def fake_tesseract(self, ok: bool) -> None:
+        # "Reconoce" el contenido del fichero tal cual, o falla
+        script = self.bin / "tesseract"
+        body = 'cat "$1"' if ok else 'echo "motor roto" >&2; exit 1'
+        script.write_text(f'#!/bin/sh\necho call >> "{self.calls}"\n{body}\n')
+        os.chmod(script, 0o755)
+        self.patch("TESSERACT_CMD", str(script))
+
+    def n_calls(self) -> int:
+        return len(self.calls.read_text().split()) if self.calls.exists() else 0
+
+    def wait_jobs(self):
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            jobs = [app.read_job(p.stem) for p in app.JOBS_ROOT.glob("*.json")]
+            if jobs and all(j["status"] in ("done", "error") for j in jobs):
+                return jobs
+            time.sleep(0.05)
+        self.fail("los trabajos de ingesta no terminan")
+
+    def test_disabled_when_binary_is_missing(self):
+        self.patch("TESSERACT_CMD", str(self.bin / "no-existe"))
+        self.assertFalse(app.ocr_enabled())
+        r = self.upload("s", "foto.png", IMAGE, message="vasopresina")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json["mode"], "chat")
+        self.assertEqual(list(app.JOBS_ROOT.glob("*.json")), [])
+
+    def test_image_is_recognised_and_indexed(self):
+        self.fake_tesseract(ok=True)
+        self.upload("s", "foto.png", IMAGE, message="vasopresina")
+        self.wait_jobs()
+        r = self.ask("s", "vasopresina en shock refractario")
+        self.assertEqual(r.json["mode"], "doc_search")
+        self.assertIn("foto.png", r.json["reply"])
+        self.assertEqual(self.n_calls(), 1)
+
+    def test_failure_is_recorded_not_retried_and_not_indexed(self):
+        self.fake_tesseract(ok=False)
+        self.upload("s", "foto.png", IMAGE, message="vasopresina")
+        job, = self.wait_jobs()
+        self.assertEqual(job["status"], "error")
+        self.assertIn("motor roto", job["files"][0]["error"])
+        self.assertEqual(app.SessionManifest(app.UPLOAD_ROOT / "s").files()["foto.png"]["status"], "error")
+
+        for _ in range(2):
+            r = self.ask("s", "adrenalina extraer texto foto")
+            self.assertNotEqual(r.json["mode"], "doc_search")
+        self.assertEqual(app.collect_session_docs(app.UPLOAD_ROOT / "s"), [])
+        self.assertEqual(self.n_calls(), 1)
+
+        # Una nueva subida del mismo fichero (sin mensaje, solo adjuntar) sí lo
+        # reintenta, en un trabajo en segundo plano y no al preguntar después
+        self.fake_tesseract(ok=True)
+        self.reset_ocr()
+        self.upload("s", "foto.png", IMAGE)
+        jobs = self.wait_jobs()
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(self.n_calls(), 2)
+        self.assertEqual(app.SessionManifest(app.UPLOAD_ROOT / "s").files()["foto.png"]["status"], "ready")
+        self.assertEqual(self.ask("s", "vasopresina").json["mode"], "doc_search")
+        self.assertEqual(self.n_calls(), 2)
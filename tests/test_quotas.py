@@ -0,0 +1,100 @@
+import io
+import os
+import threading
+import time
+
+from tests.support import AppTestCase, app, pdf_bytes
+
+PDF_A = pdf_bytes([["La dosis de adrenalina en anafilaxia es 0,5 mg intramuscular."]])
+PDF_C = pdf_bytes([["El salbutamol se nebuliza cada veinte minutos en la crisis asmática."]])
+
+
+class QuotaTests(AppTestCase):
+    def test_session_quota_rejects_with_413_and_keeps_counters(self):
+        self.patch("SESSION_QUOTA_BYTES", len(PDF_A) + 10)
+        self.assertEqual(self.upload("s", "a.pdf", PDF_A).status_code, 200)
+        r = self.upload("s", "c.pdf", PDF_C)
+        self.assertEqual(r.status_code, 413)
+        self.assertFalse((app.UPLOAD_ROOT / "s" / "c.pdf").exists())
+        usage = app.USAGE.read()
+        self.assertEqual(usage["sessions"]["s"], len(PDF_A))
+        self.assertEqual(usage["store_bytes"], len(PDF_A))  # el blob rechazado no queda en el almacén
+
+    def test_store_quota_rejects_with_507_when_nothing_can_be_swept(self):
+        self.assertEqual(self.upload("a", "a.pdf", PDF_A).status_code, 200)
+        self.patch("UPLOAD_QUOTA_BYTES", len(PDF_A) + 10)
+        r = self.upload("b", "c.pdf", PDF_C)  # "a" se usó hace nada: no se barre
+        self.assertEqual(r.status_code, 507)
+        self.assertTrue((app.UPLOAD_ROOT / "a" / "a.pdf").exists())
+        self.assertEqual(app.USAGE.read()["store_bytes"], len(PDF_A))
+        self.assertEqual(app.USAGE.read()["sessions"].get("b", 0), 0)
+
+    def test_store_quota_sweeps_least_recently_used_session(self):
+        self.upload("a", "a.pdf", PDF_A)
+        self.age_session("a", app.GC_MIN_IDLE + 60)
+        self.patch("UPLOAD_QUOTA_BYTES", len(PDF_A) + 10)
+        self.assertEqual(self.upload("b", "c.pdf", PDF_C).status_code, 200)
+        self.assertFalse((app.UPLOAD_ROOT / "a").exists())
+        self.assertEqual(app.USAGE.read()["store_bytes"], len(PDF_C))
+
+    def test_reupload_of_content_whose_only_session_is_swept(self):
+        # La subida trae el mismo contenido que la sesión que el barrido va a borrar:
+        # el blob debe sobrevivir y quedar enlazado en la sesión nueva
+        self.upload("a", "a.pdf", PDF_A)
+        self.upload("c", "c.pdf", PDF_C)
+        self.age_session("a", app.GC_MIN_IDLE + 120)
+        self.age_session("c", app.GC_MIN_IDLE + 60)
+        self.patch("UPLOAD_QUOTA_BYTES", len(PDF_A) + len(PDF_C) - 1)
+        r = self.upload("b", "a.pdf", PDF_A)
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse((app.UPLOAD_ROOT / "a").exists())
+        dest = app.UPLOAD_ROOT / "b" / "a.pdf"
+        self.assertEqual(dest.read_bytes(), PDF_A)
+        self.assertTrue(os.path.samefile(dest, app._blob_path(app.file_sha256(dest))))
+        self.assertEqual([p.name for p in (app.UPLOAD_ROOT / "b").iterdir() if p.name.endswith(".tmp")], [])
+        self.assertEqual(self.ask("b", "dosis de adrenalina").json["mode"], "doc_search")
+        self.assertEqual(app.USAGE.read()["store_bytes"], len(PDF_A))
+
+
+class IngestingSessionTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        # Trabajos de ingesta retenidos hasta que el test lo diga
+        self.gate = threading.Event()
+        self.addCleanup(self.gate.set)
+        run = app._run_ingest_job
+
+        def held(*args):
+            self.gate.wait(30)
+            run(*args)
+
+        self.patch("_run_ingest_job", held)
+
+    def submit(self, session_id: str) -> str:
+        r = self.client.post(f"/api/sessions/{session_id}/files",
+                             data={"files": [(io.BytesIO(PDF_A), "a.pdf")]}, content_type="multipart/form-data")
+        self.assertEqual(r.status_code, 202)
+        return r.json["job_id"]
+
+    def finished_job(self, job_id: str) -> dict:
+        self.gate.set()
+        deadline = time.monotonic() + 10
+        while app.read_job(job_id)["status"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return app.read_job(job_id)
+
+    def test_sweep_skips_session_with_ingest_in_progress(self):
+        job_id = self.submit("a")
+        self.age_session("a", app.GC_MIN_IDLE + 60)
+        self.patch("UPLOAD_QUOTA_BYTES", len(PDF_A) + 10)
+        self.assertEqual(self.upload("b", "c.pdf", PDF_C).status_code, 507)
+        self.assertTrue((app.UPLOAD_ROOT / "a" / "a.pdf").exists())
+        self.assertEqual(self.finished_job(job_id)["status"], "done")
+
+    def test_job_ends_in_error_if_its_session_is_deleted(self):
+        job_id = self.submit("a")
+        app.delete_session(app.UPLOAD_ROOT / "a")
+        job = self.finished_job(job_id)
+        self.assertEqual(job["status"], "error")
+        self.assertEqual(job["files"][0]["status"], "error")
+        self.assertFalse((app.UPLOAD_ROOT / "a").exists())